@@ -0,0 +1,298 @@
+# Transfer benchmarks against the simulated board (mpsim): uploads, downloads,
+# listings and syncs over a grid of file sizes and counts, for each encoding
+# and compression setting. Every measurement is one record with wall time,
+# throughput and round trips, written as JSON or CSV so runs from different
+# releases can be compared (--compare flags regressions).
+#
+#   python mpbench.py --sizes 1024,65536 --counts 1,20 -o results.json
+#   python mpbench.py --compare results.json
+#   python mpbench.py --check-encodings --baud 0
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from mpcore import SyncEngine, open_device, close_device
+from mpsim import SimulatedBoard
+
+OPERATIONS = ('command', 'upload', 'download', 'listdir', 'sync', 'sync-noop')
+FIELDS = ('operation', 'encoding', 'compress', 'file_size', 'file_count', 'bytes', 'seconds', 'kb_per_s',
+          'commands', 'round_trips', 'overruns')
+WORDS = ('import', 'def', 'return', 'self', 'value', 'machine', 'pin', 'time', 'sleep', 'print', 'for', 'in',
+         'range', 'if', 'else', 'while', 'True', 'None', '=', '+', '(', ')', ':', 'led', 'sensor', 'data')
+
+
+def make_file(path, size, rng, compressible):
+    # Source-like text by default, since that is most of what goes to a board
+    if compressible:
+        out = []
+        length = 0
+        while length < size:
+            line = ' ' * rng.choice((0, 4, 8)) + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 9)))
+            out.append(line)
+            length += len(line) + 1
+        data = '\n'.join(out).encode()[:size]
+    else:
+        data = bytes(rng.getrandbits(8) for _ in range(size))
+    with open(path, 'wb') as file:
+        file.write(data)
+
+
+def make_tree(directory, count, size, compressible, seed=0):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    names = [f"file{i:04d}.py" for i in range(count)]
+    for name in names:
+        make_file(os.path.join(directory, name), size, rng, compressible)
+    return names
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.records = []
+
+    def measure(self, board, operation, config, size, count, nbytes, fn):
+        before = board.snapshot()
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        after = board.snapshot()
+        record = {
+            'operation': operation,
+            'encoding': config[0],
+            'compress': config[1],
+            'file_size': size,
+            'file_count': count,
+            'bytes': nbytes,
+            'seconds': round(seconds, 4),
+            'kb_per_s': round(nbytes / 1024 / seconds, 2) if nbytes else None,
+        }
+        for key in ('commands', 'round_trips', 'overruns'):
+            record[key] = after[key] - before[key]
+        self.records.append(record)
+        if not self.args.quiet:
+            rate = f"{record['kb_per_s']:.1f} KB/s" if nbytes else ''
+            print(f"{operation:>10} {config[0]:>6} {'z' if config[1] else '-'} {size:>8} B x {count:<4} "
+                  f"{seconds:8.3f} s {record['round_trips']:6} rt {rate}", file=sys.stderr)
+        return record
+
+    def run_case(self, workdir, config, size, count):
+        args = self.args
+        encoding, compress = config
+        operations = args.operations
+        local = os.path.join(workdir, 'local')
+        board_root = os.path.join(workdir, 'board')
+        downloads = os.path.join(workdir, 'downloads')
+        for path in (local, board_root, downloads):
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(board_root)
+        os.makedirs(downloads)
+        names = make_tree(local, count, size, not args.incompressible)
+        total = size * count
+
+        board = SimulatedBoard(board_root, baudrate=args.baud, latency=args.latency, rx_buffer=args.rx_buffer,
+                               flow_control=args.flow_control, flash_rate=args.flash_rate, mem_free=args.mem_free,
+                               capacity=max(2 * 1024 * 1024, 4 * total))
+        with board:
+            fs = open_device(board.port, chunk_size=args.chunk_size, encoding=encoding, compress=compress,
+                             window=args.window, adaptive=args.adaptive)
+            try:
+                fs.makedirs(['/bench'])
+
+                def upload():
+                    for name in names:
+                        fs.put(os.path.join(local, name), '/bench/' + name)
+
+                def download():
+                    for name in names:
+                        fs.get('/bench/' + name, os.path.join(downloads, name))
+
+                def sync():
+                    engine = SyncEngine(fs, local, '/synced', to_board=True)
+                    engine.apply(engine.plan())
+
+                def sync_noop():
+                    engine = SyncEngine(fs, local, '/synced', to_board=True)
+                    if engine.plan():
+                        raise RuntimeError("Sync left differences behind")
+
+                if 'upload' in operations or 'download' in operations or 'listdir' in operations:
+                    self.measure(board, 'upload', config, size, count, total, upload)
+                if 'listdir' in operations:
+                    self.measure(board, 'listdir', config, size, count, 0, lambda: fs.listdir('/bench'))
+                if 'download' in operations:
+                    self.measure(board, 'download', config, size, count, total, download)
+                if 'sync' in operations or 'sync-noop' in operations:
+                    self.measure(board, 'sync', config, size, count, total, sync)
+                if 'sync-noop' in operations:
+                    self.measure(board, 'sync-noop', config, size, count, 0, sync_noop)
+            finally:
+                close_device(fs)
+
+    def run_commands(self, workdir, config):
+        # Per-command overhead, independent of file size
+        board_root = os.path.join(workdir, 'board')
+        shutil.rmtree(board_root, ignore_errors=True)
+        os.makedirs(board_root)
+        args = self.args
+        with SimulatedBoard(board_root, baudrate=args.baud, latency=args.latency) as board:
+            fs = open_device(board.port, chunk_size=args.chunk_size, encoding=config[0], compress=config[1],
+                             window=args.window, adaptive=args.adaptive)
+            try:
+                def commands():
+                    for _ in range(args.repeat):
+                        fs.repl.exec('pass')
+
+                self.measure(board, 'command', config, 0, args.repeat, 0, commands)
+            finally:
+                close_device(fs)
+
+    def run(self):
+        args = self.args
+        configs = [(encoding, compress) for encoding in args.encodings for compress in args.compression]
+        workdir = tempfile.mkdtemp(prefix='mpbench-')
+        try:
+            for config in configs:
+                if 'command' in args.operations:
+                    self.run_commands(workdir, config)
+                for size in args.sizes:
+                    for count in args.counts:
+                        self.run_case(workdir, config, size, count)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        return self.records
+
+
+def metadata(args):
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'baud': args.baud,
+        'latency': args.latency,
+        'rx_buffer': args.rx_buffer,
+        'flow_control': args.flow_control,
+        'flash_rate': args.flash_rate,
+        'mem_free': args.mem_free,
+        'chunk_size': args.chunk_size,
+        'adaptive': args.adaptive,
+        'window': args.window,
+        'incompressible': args.incompressible,
+    }
+
+
+def write_results(records, args, out):
+    if args.format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        json.dump({'meta': metadata(args), 'results': records}, out, indent=2)
+        out.write('\n')
+
+
+def compare(records, baseline_path, tolerance):
+    # Returns the number of measurements slower than the baseline by more than
+    # the tolerance (a fraction)
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    key = lambda r: (r['operation'], r['encoding'], r['compress'], r['file_size'], r['file_count'])
+    previous = {key(record): record for record in baseline}
+    regressions = 0
+    for record in records:
+        old = previous.get(key(record))
+        if not old or not old['seconds']:
+            continue
+        ratio = record['seconds'] / old['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"{record['operation']:>10} {record['encoding']:>6} {'z' if record['compress'] else '-'} "
+              f"{record['file_size']:>8} B x {record['file_count']:<4} {old['seconds']:8.3f} -> "
+              f"{record['seconds']:8.3f} s ({ratio:5.2f}x){flag}", file=sys.stderr)
+    return regressions
+
+
+def check_encodings(records, tolerance):
+    # Returns the number of raw measurements slower than the same base64 one
+    # by more than the tolerance; the binary encoding should never lose
+    key = lambda r: (r['operation'], r['compress'], r['file_size'], r['file_count'])
+    base64_records = {key(record): record for record in records if record['encoding'] == 'base64'}
+    slower = 0
+    for record in records:
+        other = base64_records.get(key(record))
+        if record['encoding'] != 'raw' or not other or not other['seconds']:
+            continue
+        ratio = record['seconds'] / other['seconds']
+        flag = ''
+        if ratio > 1 + tolerance:
+            flag = '  RAW SLOWER'
+            slower += 1
+        print(f"{record['operation']:>10} {'z' if record['compress'] else '-'} {record['file_size']:>8} B x "
+              f"{record['file_count']:<4} base64 {other['seconds']:8.3f} s, raw {record['seconds']:8.3f} s "
+              f"({ratio:5.2f}x){flag}", file=sys.stderr)
+    return slower
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='mpbench', description="Benchmark transfers against a simulated board")
+    parser.add_argument('--sizes', type=int_list, default=[1024, 16384, 131072], help="file sizes in bytes")
+    parser.add_argument('--counts', type=int_list, default=[1, 10], help="files per measurement")
+    parser.add_argument('--encodings', type=lambda text: text.split(','), default=['base64', 'raw'])
+    parser.add_argument('--compression', choices=('on', 'off', 'both'), default='both')
+    parser.add_argument('--operations', type=lambda text: text.split(','), default=list(OPERATIONS),
+                        help="comma-separated subset of: " + ', '.join(OPERATIONS))
+    parser.add_argument('--repeat', type=int, default=20, help="commands timed by the 'command' operation")
+    parser.add_argument('--incompressible', action='store_true', help="use random data instead of source text")
+    parser.add_argument('--baud', type=int, default=115200, help="emulated link speed (0 = unlimited)")
+    parser.add_argument('--latency', type=float, default=0.002, help="seconds added in each direction")
+    parser.add_argument('--rx-buffer', type=int, default=256)
+    parser.add_argument('--flow-control', action='store_true')
+    parser.add_argument('--flash-rate', type=int, default=0, help="flash write speed in bytes/s (0 = instant)")
+    parser.add_argument('--mem-free', type=int, default=100000, help="heap free on the simulated board")
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--adaptive', action='store_true', help="size chunks with a ChunkTuner (as the GUI does)")
+    parser.add_argument('--window', type=int)
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('-o', '--output', help="results file (default: stdout)")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results of an earlier run")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed slowdown before flagging (0.1 = 10%%)")
+    parser.add_argument('--check-encodings', action='store_true',
+                        help="fail if raw transfers are slower than base64 ones (needs both encodings)")
+    parser.add_argument('-q', '--quiet', action='store_true')
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.compression = {'on': [True], 'off': [False], 'both': [False, True]}[args.compression]
+    unknown = set(args.operations) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit("Unknown operation(s): " + ', '.join(sorted(unknown)))
+
+    records = Bench(args).run()
+    if args.output:
+        with open(args.output, 'w', newline='') as out:
+            write_results(records, args, out)
+    else:
+        write_results(records, args, sys.stdout)
+    failed = bool(args.compare and compare(records, args.compare, args.tolerance))
+    if args.check_encodings and check_encodings(records, args.tolerance):
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
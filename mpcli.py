@@ -0,0 +1,234 @@
+# Command line client: mpfiles ls | cp | sync | rm | df. Only imports mpcore
+# (no Qt), so scripted deployments start in a few tens of milliseconds.
+import argparse
+import os
+import sys
+import threading
+import time
+
+from mpcore import (ReplError, MicroPythonError, CompileError, SyncEngine, FleetSync, LocalIndex, Metrics,
+                    MpyCompiler, PortScanner, open_device, close_device)
+
+
+def device_path(path):
+    # Device paths are written with a leading ':' (as with mpremote); returns
+    # None for local paths
+    if not path.startswith(':'):
+        return None
+    return '/' + path[1:].lstrip('/')
+
+
+def find_ports():
+    return [device for device, is_micropython in PortScanner().scan() if is_micropython]
+
+
+def find_port():
+    ports = find_ports()
+    if not ports:
+        raise SystemExit("No MicroPython device found; use --port")
+    return ports[0]
+
+
+def device_options(args):
+    return {'chunk_size': args.chunk_size, 'encoding': args.encoding, 'compress': args.compress,
+            'window': args.window, 'metrics': args.metrics, 'adaptive': args.adaptive}
+
+
+def compiler(args):
+    return MpyCompiler(args.mpy_cross) if args.precompile else None
+
+
+def print_summary(name, size, elapsed, resumed_from=0):
+    elapsed = max(elapsed, 1e-6)
+    resumed = f", resumed after {resumed_from} bytes" if resumed_from else ''
+    print(f"{name}: {size} bytes in {elapsed:.2f} s ({size / 1024 / elapsed:.1f} KB/s){resumed}")
+
+
+def cmd_ls(fs, args):
+    path = device_path(args.path) or args.path
+    if args.recursive:
+        entries = ((entry_path, is_dir, size) for entry_path, is_dir, size, _ in fs.walk(path))
+    else:
+        entries = ((name, is_dir, size) for name, is_dir, size, _ in sorted(fs.listdir(path)))
+    for name, is_dir, size in entries:
+        print(f"{'' if is_dir else size:>10} {name}{'/' if is_dir else ''}")
+
+
+def cmd_cp(fs, args):
+    source, destination = device_path(args.source), device_path(args.destination)
+    if (source is None) == (destination is None):
+        raise SystemExit("cp needs exactly one device path (prefixed with ':')")
+
+    start = time.monotonic()
+    if destination is not None:
+        mode = fs.stat_mode(destination)
+        if destination.endswith('/') or (mode is not None and mode & 0x4000):
+            destination = destination.rstrip('/') + '/' + os.path.basename(args.source)
+        if args.precompile:
+            destination = compiler(args).put(fs, args.source, destination)
+            size = fs.last_transfer[0]
+        else:
+            size = fs.put(args.source, destination)
+    else:
+        destination = args.destination
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, os.path.basename(source))
+        size = fs.get(source, destination)
+    print_summary(destination, size, time.monotonic() - start, fs.resumed_from)
+
+
+def cmd_sync(fs, args):
+    remote = device_path(args.remote) or args.remote
+    engine = SyncEngine(fs, args.local, remote, to_board=not args.from_board, delete=args.delete,
+                        compiler=compiler(args), index=LocalIndex.open(args.local))
+    actions = engine.plan()
+    if not actions:
+        print("Already in sync")
+        return
+    if args.dry_run:
+        for action, rel in actions:
+            print(f"{action} {rel}")
+        return
+    engine.apply(actions, lambda action, rel: print(f"{action} {rel}"))
+
+
+def cmd_fleet(args):
+    ports = args.ports or find_ports()
+    if not ports:
+        raise SystemExit("No MicroPython devices found")
+    fleet = FleetSync(args.local, device_path(args.remote) or args.remote, delete=args.delete,
+                      max_workers=args.jobs, retries=args.retries, device_options=device_options(args),
+                      compiler=compiler(args))
+    lock = threading.Lock()
+
+    def progress(port, state, done, total, message):
+        # Only state changes; per-file progress would interleave unreadably
+        if state != 'syncing' or not done:
+            with lock:
+                print(f"{port}: {state} {message}".rstrip(), flush=True)
+
+    start = time.monotonic()
+    errors = fleet.run(ports, progress)
+    failed = [port for port, error in errors.items() if error is not None]
+    print(f"{len(ports) - len(failed)}/{len(ports)} board(s) synced in {time.monotonic() - start:.1f} s")
+    if failed:
+        print("Failed: " + ", ".join(failed), file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_find(fs, args):
+    path = device_path(args.path) or args.path
+    for match_path, offset, line in fs.search(path, args.name, (args.text or '').encode()):
+        if offset is None:
+            print(match_path)
+        else:
+            print(f"{match_path}:{offset}: {line.decode('utf-8', errors='replace')}")
+
+
+def cmd_rm(fs, args):
+    paths = [device_path(path) or path for path in args.paths]
+    if args.recursive:
+        print(f"{fs.remove_tree(paths)} entries removed")
+    else:
+        fs.remove(paths)
+
+
+def cmd_df(fs, args):
+    free = fs.free_space()
+    print(f"{free} bytes free ({free / 1024:.2f} KB)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='mpfiles', description="Manage files on a MicroPython board")
+    parser.add_argument('-p', '--port', help="serial port (default: first MicroPython board found)")
+    parser.add_argument('--chunk-size', type=int, default=2048)
+    parser.add_argument('--encoding', choices=('base64', 'raw'), default='base64')
+    parser.add_argument('--no-compress', dest='compress', action='store_false',
+                        help="never use deflate compression for transfers")
+    parser.add_argument('--window', type=int, help="upload bytes in flight (default: device's raw-paste window)")
+    parser.add_argument('--fixed-chunks', dest='adaptive', action='store_false',
+                        help="always use --chunk-size instead of adapting it to the board")
+    parser.add_argument('--precompile', action='store_true',
+                        help="upload .py files (except boot.py/main.py) compiled to .mpy")
+    parser.add_argument('--mpy-cross', default='mpy-cross', metavar='COMMAND', help="compiler for --precompile")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="write per-operation timings and byte counts to FILE (.json or .csv)")
+    commands = parser.add_subparsers(dest='command')
+    # Set afterwards: add_subparsers() only takes required= from Python 3.7
+    commands.required = True
+
+    ls = commands.add_parser('ls', help="list a device directory")
+    ls.add_argument('path', nargs='?', default='/')
+    ls.add_argument('-r', '--recursive', action='store_true')
+    ls.set_defaults(func=cmd_ls)
+
+    cp = commands.add_parser('cp', help="copy a file to (:dest) or from (:source) the device")
+    cp.add_argument('source')
+    cp.add_argument('destination')
+    cp.set_defaults(func=cmd_cp)
+
+    sync = commands.add_parser('sync', help="sync a local folder to a device folder")
+    sync.add_argument('local')
+    sync.add_argument('remote')
+    sync.add_argument('--from-board', action='store_true', help="copy device changes to the local folder instead")
+    sync.add_argument('--delete', action='store_true', help="delete files missing from the source")
+    sync.add_argument('-n', '--dry-run', action='store_true', help="only print the planned actions")
+    sync.set_defaults(func=cmd_sync)
+
+    fleet = commands.add_parser('fleet', help="sync a local folder to many boards in parallel")
+    fleet.add_argument('local')
+    fleet.add_argument('remote')
+    fleet.add_argument('ports', nargs='*', help="serial ports (default: every MicroPython board found)")
+    fleet.add_argument('-j', '--jobs', type=int, default=8, help="boards synced at the same time")
+    fleet.add_argument('--retries', type=int, default=2)
+    fleet.add_argument('--delete', action='store_true', help="delete files missing from the source")
+    fleet.set_defaults(func=cmd_fleet, needs_device=False)
+
+    find = commands.add_parser('find', help="search device files by name and content")
+    find.add_argument('path', nargs='?', default='/')
+    find.add_argument('--name', default='*', help="file name pattern (* and ?)")
+    find.add_argument('-e', '--text', help="only files containing TEXT, listing where it occurs")
+    find.set_defaults(func=cmd_find)
+
+    rm = commands.add_parser('rm', help="remove device files")
+    rm.add_argument('paths', nargs='+')
+    rm.add_argument('-r', '--recursive', action='store_true', help="also remove directories and their contents")
+    rm.set_defaults(func=cmd_rm)
+
+    df = commands.add_parser('df', help="show free space on the device")
+    df.set_defaults(func=cmd_df)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    metrics_path, args.metrics = args.metrics, Metrics(profile=True) if args.metrics else None
+    try:
+        return run(args)
+    finally:
+        if metrics_path:
+            args.metrics.save(metrics_path)
+
+
+def run(args):
+    if not getattr(args, 'needs_device', True):
+        return args.func(args)
+
+    port = args.port or find_port()
+    try:
+        fs = open_device(port, **device_options(args))
+    except (OSError, ReplError) as e:
+        raise SystemExit(f"Failed to connect to {port}: {e}")
+    try:
+        args.func(fs, args)
+    except (ReplError, MicroPythonError, CompileError, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        close_device(fs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,2397 @@
+# Serial protocol, device filesystem, sync and port discovery for MicroPython
+# boards. Shared by the GUI (mpfiles) and the command line (mpcli); must not
+# import Qt.
+import os
+import ast
+import re
+import csv
+import json
+import time
+import shlex
+import bisect
+import tempfile
+import subprocess
+import threading
+import struct
+import base64
+import hashlib
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import serial
+import serial.tools.list_ports
+
+
+class ReplError(Exception):
+    pass
+
+
+class ReplTimeout(ReplError):
+    pass
+
+
+class ReplCancelled(ReplError):
+    pass
+
+
+class MicroPythonError(Exception):
+    pass
+
+
+class VerificationError(ReplError):
+    pass
+
+
+class CompileError(Exception):
+    pass
+
+
+# Raw REPL transport (Ctrl-A), using raw-paste mode when the firmware supports it
+class RawRepl:
+    RAW_REPL_BANNER = b'raw REPL; CTRL-B to exit\r\n'
+
+    def __init__(self, serial_port, timeout=5):
+        self.serial = serial_port
+        self.timeout = timeout
+        self.use_raw_paste = True
+        self.in_raw_repl = False
+        self.cancel_event = None
+        # Raw-paste flow-control window reported by the firmware; a measure of
+        # its input buffer (0 until known)
+        self.input_window = 0
+        # Running totals for instrumentation (see Metrics)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._buf = bytearray()
+
+    def write(self, data):
+        self.serial.write(data)
+        self.bytes_sent += len(data)
+
+    def _fill(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise ReplCancelled("Operation cancelled")
+        # Blocks for at most the serial timeout when nothing is pending
+        chunk = self.serial.read(self.serial.in_waiting or 1)
+        if chunk:
+            self._buf += chunk
+            self.bytes_received += len(chunk)
+        return len(chunk)
+
+    def read_until(self, ending, timeout=None):
+        # Timeout is measured from the last received byte, not from the start
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        start = 0
+        while True:
+            idx = self._buf.find(ending, start)
+            if idx >= 0:
+                data = bytes(self._buf[:idx])
+                del self._buf[:idx + len(ending)]
+                return data
+            start = max(0, len(self._buf) - len(ending) + 1)
+            if self._fill():
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                raise ReplTimeout(f"Timed out waiting for {ending!r}")
+
+    def read_exact(self, size, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while len(self._buf) < size:
+            if self._fill():
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                raise ReplTimeout(f"Timed out waiting for {size} bytes")
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def enter(self):
+        self.write(b'\r\x03\x03')  # interrupt any running program
+        time.sleep(0.1)
+        self.serial.reset_input_buffer()
+        self._buf.clear()
+        self.write(b'\r\x01')
+        self.read_until(self.RAW_REPL_BANNER)
+        self.in_raw_repl = True
+
+    def exit(self):
+        if self.in_raw_repl:
+            self.write(b'\r\x02')
+            self.in_raw_repl = False
+
+    def _raw_paste_write(self, data):
+        window_inc = struct.unpack('<H', self.read_exact(2))[0]
+        self.input_window = window_inc
+        window_remain = window_inc
+        i = 0
+        while i < len(data):
+            # Consume flow-control bytes; wait for one when the window is exhausted
+            while window_remain == 0 or self._buf or self.serial.in_waiting:
+                b = self.read_exact(1)
+                if b == b'\x01':
+                    window_remain += window_inc
+                elif b == b'\x04':
+                    # Device aborted the paste (e.g. syntax error); acknowledge it
+                    self.write(b'\x04')
+                    return
+                else:
+                    raise ReplError(f"Unexpected byte during raw paste: {b!r}")
+            chunk = data[i:i + window_remain]
+            self.write(chunk)
+            window_remain -= len(chunk)
+            i += len(chunk)
+        self.write(b'\x04')
+        self.read_until(b'\x04')
+
+    def _raw_write(self, data):
+        for i in range(0, len(data), 256):
+            self.write(data[i:i + 256])
+            time.sleep(0.01)
+        self.write(b'\x04')
+        if self.read_exact(2) != b'OK':
+            raise ReplError("Could not execute command")
+
+    def exec_raw_no_follow(self, script):
+        # Starts a script without waiting for its output, so the caller can
+        # stream data to its stdin
+        if isinstance(script, str):
+            script = script.encode('utf-8')
+        if not self.in_raw_repl:
+            self.enter()
+        try:
+            self._exec_raw_no_follow(script)
+        except ReplError:
+            # Protocol state is unknown; re-enter the raw REPL on the next call
+            self.in_raw_repl = False
+            raise
+
+    def _exec_raw_no_follow(self, script):
+        self.read_until(b'>')
+
+        if self.use_raw_paste:
+            self.write(b'\x05A\x01')
+            response = self.read_exact(2)
+            if response == b'R\x01':
+                self._raw_paste_write(script)
+            elif response == b'R\x00':
+                self._raw_write(script)
+            else:
+                # Firmware predates raw-paste; it echoed "ra" of the raw REPL banner
+                self.read_until(b'w REPL; CTRL-B to exit\r\n>')
+                self.use_raw_paste = False
+                self._raw_write(script)
+        else:
+            self._raw_write(script)
+
+    def follow(self, timeout=None):
+        try:
+            stdout = self.read_until(b'\x04', timeout)
+            stderr = self.read_until(b'\x04', timeout)
+        except ReplError:
+            self.in_raw_repl = False
+            raise
+        return stdout, stderr
+
+    def exec_raw(self, script, timeout=None):
+        # Runs a whole script in one round trip and returns (stdout, stderr) as bytes
+        self.exec_raw_no_follow(script)
+        return self.follow(timeout)
+
+    def exec(self, script, timeout=None):
+        stdout, stderr = self.exec_raw(script, timeout)
+        if stderr:
+            raise MicroPythonError(stderr.decode('utf-8', errors='replace').strip())
+        return stdout
+
+
+# Framing of binary data over the serial link: base64 lines, or \x06 and a
+# two-byte little-endian length before each binary frame. An empty frame ends
+# a stream. rd() reads a frame from stdin, o(b) writes one to stdout and
+# done() restores the console after a transfer. Binary frames are read into
+# one buffer of the largest frame size, so receiving allocates nothing per
+# frame; rd() returns a view that the next call overwrites.
+FRAME_READ_BASE64 = """\
+import sys
+try:
+    from ubinascii import a2b_base64
+except ImportError:
+    from binascii import a2b_base64
+def rd():
+    return a2b_base64(sys.stdin.readline())
+def done():
+    pass
+"""
+
+FRAME_READ_RAW = """\
+import sys, micropython
+micropython.kbd_intr(-1)
+ri = sys.stdin.buffer.readinto
+B = bytearray({frame_size})
+M = memoryview(B)
+def rx(m):
+    while m:
+        m = m[ri(m):]
+def rd():
+    rx(M[:2])
+    n = B[0] | B[1] << 8
+    rx(M[:n])
+    return M[:n]
+def done():
+    micropython.kbd_intr(3)
+"""
+
+FRAME_WRITE_BASE64 = """\
+import sys
+try:
+    from ubinascii import b2a_base64
+except ImportError:
+    from binascii import b2a_base64
+def o(b):
+    sys.stdout.write(b2a_base64(b))
+"""
+
+FRAME_WRITE_RAW = """\
+import sys
+wb = sys.stdout.buffer.write
+def o(b):
+    wb(b'\\x06' + len(b).to_bytes(2, 'little'))
+    wb(b)
+"""
+
+# SHA-256 for verified transfers: hx(h) is the hex digest of h
+DIGEST_SCRIPT = """\
+try:
+    from hashlib import sha256
+    from binascii import hexlify
+except ImportError:
+    from uhashlib import sha256
+    from ubinascii import hexlify
+def hx(h):
+    return hexlify(h.digest()).decode()
+"""
+
+# Only sent when resuming: hf(f, h, n) feeds the next n bytes (all when
+# negative) of file f into h
+PREFIX_DIGEST_SCRIPT = """\
+def hf(f, h, n=-1):
+    b = bytearray(512)
+    m = memoryview(b)
+    while n:
+        r = f.readinto(m if n < 0 or n > 512 else m[:n])
+        if not r:
+            break
+        h.update(m[:r])
+        n -= r if n > 0 else 0
+    return h
+"""
+
+# Uploads are written to <path>.mpf-part. The device hashes the data as it
+# writes it, and the finish script renames the partial file over the
+# destination only if the digest matches; a stream ended early leaves the
+# partial file for the next attempt.
+RECEIVE_START_SCRIPT = """\
+import os
+t = {part!r}
+h = sha256()
+f = open(t, 'wb')
+"""
+
+# Instead of RECEIVE_START_SCRIPT for uploads that may resume: reports the
+# partial file's size and hash ("<size> <sha256>", or "0 -"), and the host
+# answers with a frame holding the offset it resumes from (the partial file's
+# size, or 0 to start over)
+RECEIVE_RESUME_SCRIPT = """\
+import os
+t = {part!r}
+h = sha256()
+try:
+    f = open(t, 'rb')
+    hf(f, h)
+    f.close()
+    sys.stdout.write('%d %s\\n' % (os.stat(t)[6], hx(h)))
+except OSError:
+    sys.stdout.write('0 -\\n')
+if int(bytes(rd())):
+    f = open(t, 'ab')
+else:
+    f = open(t, 'wb')
+    h = sha256()
+"""
+
+# A short partial file is kept for resuming; a full one that doesn't match is
+# removed. os.rename replaces an existing destination.
+RECEIVE_FINISH_SCRIPT = """\
+if hx(h) != {digest!r}:
+    if os.stat(t)[6] >= {size}:
+        os.remove(t)
+    raise ValueError('upload incomplete or corrupted')
+os.rename(t, {path!r})
+"""
+
+# Plain upload receiver, run between RECEIVE_START_SCRIPT and
+# RECEIVE_FINISH_SCRIPT: writes frames until the empty one and acknowledges
+# each once written with \x06 and a sequence character ('0' + n % 64), so the
+# host can keep a bounded number of frames in flight and match each ack to its
+# frame. Frames may vary in size (see ChunkTuner).
+UPLOAD_SCRIPT = """\
+q = 0
+try:
+    while 1:
+        b = rd()
+        if not b:
+            break
+        h.update(b)
+        f.write(b)
+        sys.stdout.write('\\x06' + chr(48 + q % 64))
+        q += 1
+finally:
+    f.close()
+    done()
+"""
+
+# Device-side sender for DeviceFS.get/get_tree: send(p, s) opens the file
+# once, hashes the first s bytes (which the host already has; needs
+# PREFIX_DIGEST_SCRIPT) and streams the rest out as frames, read into one
+# buffer shared by every file, followed by the whole file's digest on a line
+SEND_SCRIPT = """\
+c = bytearray({chunk_size})
+v = memoryview(c)
+def send(p, s=0):
+    h = sha256()
+    f = open(p, 'rb')
+    try:
+        if s:
+            hf(f, h, s)
+        while 1:
+            n = f.readinto(c)
+            h.update(v[:n])
+            o(v[:n])
+            if not n:
+                break
+    finally:
+        f.close()
+    sys.stdout.write(hx(h) + '\\n')
+"""
+
+# Compressed transfers. The device inflates uploads straight into the file
+# through deflate.DeflateIO (or zlib.DecompIO on older firmware) reading from
+# a stream that acknowledges each frame once consumed (same sequenced acks as
+# the plain receivers), and deflates downloads when
+# the firmware was built with compression. The host picks a small window so
+# the device only needs 2**wbits bytes of history. The stream hands out each
+# frame from an offset rather than re-slicing it, and inflated data goes
+# through a fixed buffer.
+COMPRESSION_PROBE_SCRIPT = """\
+d = c = 0
+try:
+    import io
+    io.IOBase
+    try:
+        import deflate
+        d = 'deflate'
+        z = deflate.DeflateIO(io.BytesIO(), deflate.ZLIB, {wbits})
+        z.write(b'x')
+        z.close()
+        c = 1
+    except ImportError:
+        import zlib
+        zlib.DecompIO
+        d = 'zlib'
+except Exception:
+    pass
+print(d, c)
+"""
+
+UPLOAD_DEFLATE_SCRIPT = """\
+import io
+try:
+    import deflate
+    def D(s):
+        return deflate.DeflateIO(s, deflate.ZLIB)
+except ImportError:
+    import zlib
+    def D(s):
+        return zlib.DecompIO(s, {wbits})
+class S(io.IOBase):
+    def __init__(self):
+        self.b = b''
+        self.i = self.e = self.q = 0
+    def readinto(self, buf):
+        if self.i == len(self.b) and not self.e:
+            self.b = rd()
+            self.i = 0
+            self.e = not self.b
+        n = min(len(buf), len(self.b) - self.i)
+        buf[:n] = self.b[self.i:self.i + n]
+        self.i += n
+        if n and self.i == len(self.b):
+            sys.stdout.write('\\x06' + chr(48 + self.q % 64))
+            self.q += 1
+        return n
+s = S()
+c = bytearray({chunk_size})
+v = memoryview(c)
+try:
+    d = D(s)
+    while 1:
+        n = d.readinto(c)
+        if not n:
+            break
+        h.update(v[:n])
+        f.write(v[:n])
+    while not s.e:
+        s.i = len(s.b)
+        s.readinto(c)
+finally:
+    f.close()
+    done()
+"""
+
+SEND_DEFLATE_SCRIPT = """\
+import io, deflate
+class W(io.IOBase):
+    def __init__(self):
+        self.b = bytearray()
+    def write(self, b):
+        self.b += b
+        while len(self.b) >= {chunk_size}:
+            o(self.b[:{chunk_size}])
+            self.b = self.b[{chunk_size}:]
+        return len(b)
+c = bytearray({chunk_size})
+v = memoryview(c)
+def send(p, s=0):
+    h = sha256()
+    f = open(p, 'rb')
+    w = W()
+    try:
+        if s:
+            hf(f, h, s)
+        z = deflate.DeflateIO(w, deflate.ZLIB, {wbits})
+        while 1:
+            n = f.readinto(c)
+            if not n:
+                break
+            h.update(v[:n])
+            z.write(v[:n])
+        z.close()
+    finally:
+        f.close()
+    if w.b:
+        o(w.b)
+    o(b'')
+    sys.stdout.write(hx(h) + '\\n')
+"""
+
+# "<size> <offset>": the host resumes a partial download from its size unless
+# the file has become shorter
+DOWNLOAD_SCRIPT = """\
+import os
+n = os.stat({path!r})[6]
+s = {offset} if {offset} <= n else 0
+sys.stdout.write('%d %d\\n' % (n, s))
+send({path!r}, s)
+"""
+
+# Streams "<st_mode> <size> <mtime> <path>" for every entry below a directory,
+# ending with an empty line. When send() is defined each file line is
+# followed by the file's content, so a tree download is a single command.
+WALK_SCRIPT = """\
+import os, sys
+w = sys.stdout.write
+s = [{path!r}.rstrip('/')]
+while s:
+    p = s.pop()
+    try:
+        it = os.ilistdir(p or '/')
+    except AttributeError:
+        it = ((n,) for n in os.listdir(p or '/'))
+    for e in it:
+        f = p + '/' + e[0]
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        w('%d %d %d %s\\n' % (st[0], st[6], st[8], f))
+        if st[0] & 0x4000:
+            s.append(f)
+        elif send:
+            send(f)
+w('\\n')
+"""
+
+# One line per entry: "<st_mode> <size> <mtime> <name>". ilistdir avoids
+# building the whole name list; stat runs on the device, not per round trip.
+LISTDIR_SCRIPT = """\
+import os, sys
+p = {path!r}
+d = p.rstrip('/') + '/'
+w = sys.stdout.write
+try:
+    it = os.ilistdir(p)
+except AttributeError:
+    it = ((n, 0x8000, 0) for n in os.listdir(p))
+for e in it:
+    n = e[0]
+    try:
+        s = os.stat(d + n)
+        w('%d %d %d %s\\n' % (s[0], s[6], s[8], n))
+    except OSError:
+        w('%d %d 0 %s\\n' % (e[1], e[3] if len(e) > 3 else 0, n))
+"""
+
+# "<sha256 hex> <path>" per readable file; missing files are skipped
+HASH_SCRIPT = """\
+import sys
+try:
+    import hashlib
+except ImportError:
+    import uhashlib as hashlib
+try:
+    from ubinascii import hexlify
+except ImportError:
+    from binascii import hexlify
+b = bytearray(512)
+m = memoryview(b)
+for p in {paths!r}:
+    try:
+        f = open(p, 'rb')
+    except OSError:
+        continue
+    h = hashlib.sha256()
+    while 1:
+        n = f.readinto(b)
+        if not n:
+            break
+        h.update(m[:n])
+    f.close()
+    sys.stdout.write('%s %s\\n' % (hexlify(h.digest()).decode(), p))
+"""
+
+MAKEDIRS_SCRIPT = """\
+import os
+for p in {paths!r}:
+    try:
+        os.mkdir(p)
+    except OSError:
+        pass
+"""
+
+# "<st_mode> <size>" per path, in order; "-1 0" for a missing one
+STAT_SCRIPT = """\
+import os
+for p in {paths!r}:
+    try:
+        s = os.stat(p)
+        print(s[0], s[6])
+    except OSError:
+        print(-1, 0)
+"""
+
+# Free heap after a collection and the board's unique id, if it has one
+PROBE_SCRIPT = """\
+import gc
+gc.collect()
+i = ''
+try:
+    import machine, binascii
+    i = binascii.hexlify(machine.unique_id()).decode()
+except Exception:
+    pass
+print(gc.mem_free(), i)
+"""
+
+MPY_TARGET_SCRIPT = """\
+import sys
+try:
+    print(sys.implementation._mpy)
+except AttributeError:
+    print(-1)
+"""
+
+# Native code architectures in the order of sys.implementation._mpy >> 10,
+# named as mpy-cross's -march expects them
+MPY_ARCHS = (None, 'x86', 'x64', 'armv6', 'armv6m', 'armv7m', 'armv7em', 'armv7emsp', 'armv7emdp', 'xtensa',
+             'xtensawin', 'rv32imc')
+
+# Finds files below a directory whose name matches a glob (* and ?), and with
+# a pattern, the places their content contains it. Files are read in 512-byte
+# buffers, keeping a partial line (up to 80 bytes) and a possible partial
+# match between them. Streams "<offset>\t<line repr>\t<path>" per match, the
+# line cut to 60 bytes around the match (offset -1 and no line for name-only
+# searches), ending with an empty line.
+SEARCH_SCRIPT = """\
+import os, sys
+w = sys.stdout.write
+g = {glob!r}
+q = {pattern!r}
+def gm(n):
+    i = j = 0
+    k = m = -1
+    while i < len(n):
+        if j < len(g) and g[j] in (n[i], '?'):
+            i += 1
+            j += 1
+        elif j < len(g) and g[j] == '*':
+            k = j
+            m = i
+            j += 1
+        elif k >= 0:
+            j = k + 1
+            m += 1
+            i = m
+        else:
+            return 0
+    while j < len(g) and g[j] == '*':
+        j += 1
+    return j == len(g)
+def grep(p):
+    f = open(p, 'rb')
+    c = b''
+    k = j = 0
+    try:
+        while 1:
+            b = f.read(512)
+            if not b:
+                break
+            c += b
+            i = c.find(q, j)
+            while i >= 0:
+                e = c.find(b'\\n', i)
+                e = min(e if e >= 0 else len(c), i + len(q) + 60)
+                l = c[max(c.rfind(b'\\n', 0, i) + 1, i - 60):e]
+                w('%d\\t%r\\t%s\\n' % (k + i, l, p))
+                i = c.find(q, i + 1)
+            j = max(len(c) - len(q) + 1, 0)
+            t = min(j, max(c.rfind(b'\\n') + 1, len(c) - 80))
+            c = c[t:]
+            k += t
+            j -= t
+    finally:
+        f.close()
+s = [{path!r}.rstrip('/')]
+while s:
+    p = s.pop()
+    for n in os.listdir(p or '/'):
+        f = p + '/' + n
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        if st[0] & 0x4000:
+            s.append(f)
+        elif gm(n):
+            if q:
+                grep(f)
+            else:
+                w('-1\\t\\t%s\\n' % f)
+w('\\n')
+"""
+
+REMOVE_SCRIPT = """\
+import os
+for p in {files!r}:
+    os.remove(p)
+for p in {dirs!r}:
+    try:
+        os.rmdir(p)
+    except OSError:
+        pass
+"""
+
+# Removes files and whole directory trees: each tree is walked top-down
+# removing files, then its directories are removed deepest first. Streams the
+# running count of removed entries every 16, then the total and an empty line.
+REMOVE_TREE_SCRIPT = """\
+import os, sys
+n = 0
+for r in {paths!r}:
+    s = [r]
+    d = []
+    while s:
+        p = s.pop()
+        if os.stat(p)[0] & 0x4000:
+            d.append(p)
+            s.extend(p + '/' + e for e in os.listdir(p))
+            continue
+        os.remove(p)
+        n += 1
+        if not n % 16:
+            sys.stdout.write('%d\\n' % n)
+    while d:
+        os.rmdir(d.pop())
+        n += 1
+sys.stdout.write('%d\\n\\n' % n)
+"""
+
+
+# Instrumentation for DeviceFS. Every device operation becomes a record:
+# category, wall time, bytes each way, file payload versus protocol overhead
+# (scripts, encoding, framing, acks) and outcome. Records are aggregated per
+# category into latency histograms and totals. Thread-safe, so one instance can
+# serve a whole fleet. With profile=True each record also splits its time into
+# host CPU (encoding, compression), estimated wire time at the link rate and
+# the rest, spent waiting on the device.
+class Metrics:
+    LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+    FIELDS = ('time', 'category', 'seconds', 'sent', 'received', 'payload', 'overhead', 'retries', 'error',
+              'host', 'wire', 'device')
+
+    def __init__(self, history=5000, profile=False, link_rate=None):
+        self.history = history
+        self.profile = profile
+        # Bytes per second on the link for the wire-time estimate; None uses
+        # the port's baud rate (USB boards are faster than they claim)
+        self.link_rate = link_rate
+        # hook(record) runs after each operation, on the thread that ran it
+        self.hooks = []
+        self._lock = threading.Lock()
+        self._repls = []
+        self._detached_bytes = 0
+        self._rate_samples = deque()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.records = deque(maxlen=self.history)
+            self.categories = {}
+
+    def attach(self, repl):
+        with self._lock:
+            self._repls.append(repl)
+
+    def detach(self, repl):
+        with self._lock:
+            if repl in self._repls:
+                self._repls.remove(repl)
+                self._detached_bytes += repl.bytes_sent + repl.bytes_received
+
+    def record(self, category, seconds, sent, received, payload=0, retries=0, error=None, host=0.0,
+               link_rate=0):
+        record = {
+            'time': round(time.time(), 3),
+            'category': category,
+            'seconds': round(seconds, 6),
+            'sent': sent,
+            'received': received,
+            'payload': payload,
+            'overhead': max(0, sent + received - payload),
+            'retries': retries,
+            'error': error,
+            'host': None,
+            'wire': None,
+            'device': None,
+        }
+        if self.profile:
+            link_rate = self.link_rate or link_rate
+            host = min(host, seconds)
+            wire = min((sent + received) / link_rate if link_rate else 0.0, seconds - host)
+            record.update(host=round(host, 6), wire=round(wire, 6), device=round(seconds - host - wire, 6))
+
+        with self._lock:
+            self.records.append(record)
+            stats = self.categories.get(category)
+            if stats is None:
+                stats = self.categories[category] = {
+                    'count': 0, 'errors': 0, 'timeouts': 0, 'retries': 0, 'seconds': 0.0, 'payload': 0,
+                    'overhead': 0, 'host': 0.0, 'wire': 0.0, 'device': 0.0,
+                    'histogram': [0] * (len(self.LATENCY_BUCKETS_MS) + 1), 'latencies': deque(maxlen=1000)}
+            stats['count'] += 1
+            stats['errors'] += error is not None
+            stats['timeouts'] += error == 'timeout'
+            stats['retries'] += retries
+            stats['seconds'] += seconds
+            stats['payload'] += payload
+            stats['overhead'] += record['overhead']
+            if self.profile:
+                for key in ('host', 'wire', 'device'):
+                    stats[key] += record[key]
+            stats['histogram'][bisect.bisect_left(self.LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+            stats['latencies'].append(seconds)
+        for hook in self.hooks:
+            hook(record)
+        return record
+
+    @staticmethod
+    def _percentile(values, fraction):
+        if not values:
+            return None
+        values = sorted(values)
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    def summary(self):
+        # {category: totals, p50/p99 latency over the last 1000 operations,
+        # payload KB/s and latency histogram}
+        with self._lock:
+            result = {}
+            for category, stats in sorted(self.categories.items()):
+                latencies = list(stats['latencies'])
+                p50, p99 = self._percentile(latencies, 0.5), self._percentile(latencies, 0.99)
+                summary = {key: round(value, 6) if isinstance(value, float) else value
+                           for key, value in stats.items() if key != 'latencies'}
+                summary['histogram'] = list(stats['histogram'])
+                summary['p50_ms'] = round(p50 * 1000, 2) if p50 is not None else None
+                summary['p99_ms'] = round(p99 * 1000, 2) if p99 is not None else None
+                summary['kb_per_s'] = round(stats['payload'] / 1024 / stats['seconds'], 2) if stats['seconds'] else 0
+                result[category] = summary
+            return result
+
+    def transfer_rate(self, window=3.0):
+        # Bytes per second on the link over the last few seconds, across all
+        # attached connections; meant to be polled, e.g. once a second
+        now = time.monotonic()
+        with self._lock:
+            total = self._detached_bytes + sum(repl.bytes_sent + repl.bytes_received for repl in self._repls)
+            samples = self._rate_samples
+            samples.append((now, total))
+            while len(samples) > 2 and now - samples[0][0] > window:
+                samples.popleft()
+            (start, first), (end, last) = samples[0], samples[-1]
+        return (last - first) / (end - start) if end > start else 0.0
+
+    def to_dict(self):
+        with self._lock:
+            records = list(self.records)
+        return {'latency_buckets_ms': list(self.LATENCY_BUCKETS_MS), 'summary': self.summary(), 'records': records}
+
+    def save(self, path):
+        # JSON (summary and records) or, for a .csv path, one row per record
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'w', newline='') as file:
+            if path.lower().endswith('.csv'):
+                writer = csv.DictWriter(file, fieldnames=self.FIELDS)
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+
+
+# Per-thread CPU time, for the host share of an operation (3.7+)
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+# AIMD frame sizing for transfers. Upload frames grow by STEP while the
+# throughput measured from the device's acknowledgements keeps improving and go
+# back a step when it drops; a MemoryError or timeout halves the size (a
+# MemoryError also lowers the ceiling). The ceiling starts from the board's
+# free heap; state()/restore() let callers remember the result per board.
+class ChunkTuner:
+    MINIMUM = 256
+    STEP = 256
+    # Samples to wait after an increase that didn't pay off before probing again
+    HOLD = 4
+
+    def __init__(self, size=2048, maximum=0xFFFF, interval=0.1):
+        self.size = size
+        self.maximum = maximum
+        self.limit = 0xFFFF
+        # Seconds of acknowledgements per throughput sample
+        self.interval = interval
+        self.rtt = None
+        self._bytes = 0
+        self._seconds = 0.0
+        self._previous = None
+        self._hold = 0
+        self._clamp()
+
+    def _clamp(self):
+        self.maximum = max(self.MINIMUM, min(self.maximum, self.limit))
+        self.size = max(self.MINIMUM, min(self.size, self.maximum))
+
+    def fit(self, mem_free, rtt):
+        # A frame is held about three times over while it is decoded and
+        # written; leave the rest of the heap to the user's program
+        self.limit = max(self.MINIMUM, min(mem_free // 8, 0xFFFF))
+        self.rtt = rtt
+        self.interval = max(self.interval, 4 * rtt)
+        self._clamp()
+
+    def state(self):
+        return {'size': self.size, 'maximum': self.maximum}
+
+    def restore(self, state):
+        self.size = int(state.get('size', self.size))
+        self.maximum = int(state.get('maximum', self.maximum))
+        self._clamp()
+
+    def sample(self, nbytes, seconds):
+        self._bytes += nbytes
+        self._seconds += seconds
+        if self._seconds < self.interval:
+            return
+        rate = self._bytes / self._seconds
+        self._bytes, self._seconds = 0, 0.0
+        if self._previous and rate < self._previous[1] * 0.95:
+            self.size = self._previous[0]
+            self._previous = None
+            self._hold = self.HOLD
+        elif self._hold:
+            self._hold -= 1
+        elif self.size < self.maximum:
+            self._previous = (self.size, rate)
+            self.size = min(self.size + self.STEP, self.maximum)
+
+    def backoff(self, error):
+        # Returns True when the failed transfer is worth retrying with the
+        # smaller frames
+        if self.size <= self.MINIMUM:
+            return False
+        if isinstance(error, MicroPythonError) and 'MemoryError' in str(error):
+            self.maximum = max(self.MINIMUM, self.size - self.STEP)
+        elif not isinstance(error, ReplTimeout):
+            return False
+        self.size = max(self.MINIMUM, self.size // 2)
+        self._previous = None
+        self._hold = self.HOLD
+        return True
+
+
+class Operation:
+    # Filled in by a DeviceFS operation for its metrics record
+    def __init__(self):
+        self.payload = 0
+        self.retries = 0
+
+
+def error_kind(error):
+    if error is None:
+        return None
+    if isinstance(error, ReplTimeout):
+        return 'timeout'
+    if isinstance(error, (ReplCancelled, GeneratorExit)):
+        return 'cancelled'
+    return type(error).__name__
+
+
+class DeviceFS:
+    ENCODINGS = ('base64', 'raw')
+    COMPRESS_WBITS = 10
+    # Transfers go to <destination>.mpf-part first and are resumed from it
+    PART_SUFFIX = '.mpf-part'
+    # Times a transfer is resumed after a timeout before giving up
+    RESUME_ATTEMPTS = 2
+    # Smaller uploads start over rather than spend a round trip checking for
+    # a partial file (unless retrying)
+    RESUME_MIN_SIZE = 32768
+    # Smallest frame worth pipelining without a tuner
+    PIPELINE_MIN_FRAME = 512
+
+    def __init__(self, repl, chunk_size=2048, encoding='base64', compress=False, window=None, metrics=None,
+                 tuner=None):
+        if encoding not in self.ENCODINGS:
+            raise ValueError(f"Unknown upload encoding: {encoding}")
+        self.repl = repl
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+        self.compress = compress
+        # Bytes of upload data allowed in flight; None uses the device's
+        # raw-paste window
+        self.window = window
+        self._compression = None
+        self._mpy_target = False
+        # (file bytes, payload bytes on the link) of the last put/get, and the
+        # offset it resumed from
+        self.last_transfer = (0, 0)
+        self.resumed_from = 0
+        self.metrics = metrics
+        self._measuring = False
+        # ChunkTuner sizing frames adaptively, or None for fixed chunk_size
+        self.tuner = tuner
+        self.board_id = None
+
+    @contextmanager
+    def _measure(self, category):
+        # Records the enclosed operation in self.metrics; operations nested in
+        # it (e.g. a put during a sync step) count towards the outer one
+        op = Operation()
+        metrics = self.metrics
+        if metrics is None or self._measuring:
+            yield op
+            return
+        self._measuring = True
+        repl = self.repl
+        sent, received = repl.bytes_sent, repl.bytes_received
+        start, cpu = time.perf_counter(), thread_time()
+        error = None
+        try:
+            yield op
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self._measuring = False
+            metrics.record(category, time.perf_counter() - start, repl.bytes_sent - sent,
+                           repl.bytes_received - received, op.payload, op.retries, error_kind(error),
+                           thread_time() - cpu, getattr(repl.serial, 'baudrate', 0) / 10)
+
+    def compression(self):
+        # Returns (decompressor module or None, device can compress); probed
+        # once per connection
+        if self._compression is None:
+            name, can_compress = self.repl.exec(COMPRESSION_PROBE_SCRIPT.format(wbits=self.COMPRESS_WBITS)).split()
+            self._compression = (None if name == b'0' else name.decode(), can_compress == b'1')
+        return self._compression
+
+    def _compressed_uploads(self):
+        return self.compress and self.compression()[0] is not None
+
+    def _compressed_downloads(self):
+        return self.compress and self.compression()[1]
+
+    def pipeline_window(self):
+        return self.repl.input_window if self.window is None else self.window
+
+    def transfer_chunk(self):
+        return min(self.tuner.size if self.tuner else self.chunk_size, 0xFFFF)
+
+    def _max_frame(self):
+        # Upper bound of _frame_payload() for a whole upload: the size of the
+        # device's receive buffer
+        return max(min(self.tuner.maximum if self.tuner else self.chunk_size, 0xFFFF), 32)
+
+    def _frame_payload(self, header=0):
+        # Largest frame whose encoded size lets two frames share the window.
+        # When that would be smaller than PIPELINE_MIN_FRAME (the usual
+        # 128-byte raw-paste window), the per-frame round trips cost more
+        # than pipelining saves: frames are whole chunks sent stop-and-wait.
+        # Tuned frames are used as they are: larger ones go stop-and-wait.
+        if self.tuner:
+            return self.tuner.size
+        budget = self.pipeline_window() // 2 - header
+        if self.encoding == 'base64':
+            budget = (budget - 1) // 4 * 3
+        if budget < min(self.chunk_size, self.PIPELINE_MIN_FRAME):
+            return min(self.chunk_size, 0xFFFF)
+        return min(self.chunk_size, budget, 0xFFFF)
+
+    def _wait_ack(self, seq):
+        ack = self.repl.read_exact(1)
+        if ack == b'\x06':
+            if self.repl.read_exact(1)[0] != 48 + seq % 64:
+                raise ReplError(f"Acknowledgement out of sequence (expected chunk {seq})")
+            return
+        if ack == b'\x04':
+            # Script ended early: what follows is its traceback
+            stderr = self.repl.read_until(b'\x04')
+            raise MicroPythonError(stderr.decode('utf-8', errors='replace').strip())
+        raise ReplError(f"Unexpected response during upload: {ack!r}")
+
+    def _retry(self, error, op):
+        # Whether to run a failed put/get again, resuming from the partial
+        # file: after a timeout or data lost on the link (the receiver fails
+        # to decode a frame, or ends early), or a MemoryError when the tuner
+        # can make frames smaller. Only base64: the rest of an abandoned
+        # binary frame would be taken as REPL control characters.
+        if self.encoding != 'base64':
+            return False
+        if not (self.tuner and self.tuner.backoff(error)):
+            transient = isinstance(error, ReplTimeout) or not re.search(r'OSError|MemoryError', str(error))
+            if not transient or op.retries >= self.RESUME_ATTEMPTS:
+                return False
+        op.retries += 1
+        self.repl.in_raw_repl = False
+        return True
+
+    def put(self, local_path, remote_path, progress=None):
+        with self._measure('upload') as op:
+            while True:
+                try:
+                    op.payload = self._put(local_path, remote_path, progress, op, op.retries > 0)
+                    return op.payload
+                except (ReplTimeout, MicroPythonError) as e:
+                    if not self._retry(e, op):
+                        raise
+
+    def _put(self, local_path, remote_path, progress, op, resume=False):
+        resume = resume or os.path.getsize(local_path) >= self.RESUME_MIN_SIZE
+        if self._compressed_uploads():
+            try:
+                return self._put_compressed(local_path, remote_path, progress, resume)
+            except MicroPythonError:
+                # Most likely no memory for the inflate window; a plain
+                # transfer tells whether the file itself was the problem
+                op.retries += 1
+                size = self._put_plain(local_path, remote_path, progress, True)
+                self._compression = (None, False)
+                return size
+        return self._put_plain(local_path, remote_path, progress, resume)
+
+    def _send_pipelined(self, frames, progress=None, size=0):
+        # Writes encoded (data, file bytes consumed) frames to a receiver that
+        # acknowledges each one in order. New frames go out while earlier ones
+        # are still being written on the device, as long as the unacknowledged
+        # bytes fit the window, so bulk transfers are limited by bandwidth
+        # rather than by a round trip per chunk.
+        # With a tuner, the time between acknowledgements is its throughput
+        # feedback.
+        window = self.pipeline_window()
+        tuner = self.tuner
+        in_flight = deque()
+        in_flight_bytes = 0
+        seq = 0
+        last = time.perf_counter()
+
+        def acknowledged():
+            nonlocal seq, in_flight_bytes, last
+            self._wait_ack(seq)
+            seq += 1
+            length, done = in_flight.popleft()
+            in_flight_bytes -= length
+            if tuner:
+                now = time.perf_counter()
+                tuner.sample(length, now - last)
+                last = now
+            if progress:
+                progress(done, size)
+
+        for data, consumed in frames:
+            while in_flight and in_flight_bytes + len(data) > window:
+                acknowledged()
+            if not in_flight:
+                last = time.perf_counter()
+            self.repl.write(data)
+            in_flight.append((len(data), consumed))
+            in_flight_bytes += len(data)
+        while in_flight:
+            acknowledged()
+
+    def _encode_frame(self, frame):
+        if self.encoding == 'raw':
+            return len(frame).to_bytes(2, 'little') + frame
+        return base64.b64encode(frame) + b'\n'
+
+    def _receiver_script(self, body, local_path, remote_path, resume=False):
+        if self.encoding == 'raw':
+            script = FRAME_READ_RAW.format(frame_size=self._max_frame())
+        else:
+            script = FRAME_READ_BASE64
+        script += DIGEST_SCRIPT
+        part = remote_path + self.PART_SUFFIX
+        if resume:
+            script += PREFIX_DIGEST_SCRIPT + RECEIVE_RESUME_SCRIPT.format(part=part)
+        else:
+            script += RECEIVE_START_SCRIPT.format(part=part)
+        return script + body + RECEIVE_FINISH_SCRIPT.format(size=os.path.getsize(local_path),
+                                                            digest=sha256_file(local_path), path=remote_path)
+
+    def _resume_upload(self, file, size, resume):
+        # Answers the receiver's report on the partial file: resumes from its
+        # end if it matches the start of file, otherwise starts over. Returns
+        # the offset, with file positioned there.
+        self.resumed_from = 0
+        if not resume:
+            return 0
+        part_size, digest = self._read_stream_line().decode().split()
+        offset = int(part_size)
+        if offset and (offset > size or sha256_read(file, offset).hexdigest() != digest):
+            offset = 0
+        file.seek(offset)
+        self.repl.write(self._encode_frame(str(offset).encode()))
+        self.resumed_from = offset
+        return offset
+
+    def _abandon_upload(self, error):
+        if isinstance(error, ReplCancelled):
+            # Only whole frames were written: end the stream so the receiver
+            # keeps what it has (and a raw one gives the console back)
+            self.repl.write(self._encode_frame(b''))
+        # Frames still in flight when the receiver failed land in the raw
+        # REPL's line buffer; the next command re-enters it with Ctrl-C
+        self.repl.in_raw_repl = False
+
+    def _compressed_frames(self, file, header):
+        # Yields (frame, file bytes consumed so far) until the stream is flushed
+        compressor = zlib.compressobj(9, zlib.DEFLATED, self.COMPRESS_WBITS)
+        buffer = memoryview(bytearray(self.chunk_size))
+        pending = b''
+        while True:
+            chunk = buffer[:file.readinto(buffer)]
+            pending += compressor.compress(chunk) if chunk else compressor.flush()
+            frame_size = self._frame_payload(header)
+            while len(pending) >= frame_size or (pending and not chunk):
+                yield pending[:frame_size], file.tell()
+                pending = pending[frame_size:]
+                frame_size = self._frame_payload(header)
+            if not chunk:
+                return
+
+    def _put_compressed(self, local_path, remote_path, progress=None, resume=False):
+        size = os.path.getsize(local_path)
+        self.repl.exec_raw_no_follow(self._receiver_script(UPLOAD_DEFLATE_SCRIPT.format(
+            chunk_size=self.transfer_chunk(), wbits=self.COMPRESS_WBITS), local_path, remote_path, resume))
+        wire = 0
+
+        def frames(file):
+            nonlocal wire
+            for frame, consumed in self._compressed_frames(file, header=2 if self.encoding == 'raw' else 0):
+                wire += len(frame)
+                yield self._encode_frame(frame), consumed
+
+        try:
+            with open(local_path, 'rb') as file:
+                offset = self._resume_upload(file, size, resume)
+                self._send_pipelined(frames(file), progress, size)
+            self.repl.write(self._encode_frame(b''))
+        except Exception as e:
+            self._abandon_upload(e)
+            raise
+
+        self._finish_stream()
+        self.last_transfer = (size - offset, wire)
+        return size - offset
+
+    def _put_plain(self, local_path, remote_path, progress=None, resume=False):
+        size = os.path.getsize(local_path)
+        header = 2 if self.encoding == 'raw' else 0
+
+        # Read into one buffer; each frame is encoded from a view of it
+        buffer = memoryview(bytearray(0x10000))
+
+        def frames(file):
+            while True:
+                read = file.readinto(buffer[:self._frame_payload(header)])
+                if not read:
+                    return
+                yield self._encode_frame(buffer[:read]), file.tell()
+
+        self.repl.exec_raw_no_follow(self._receiver_script(UPLOAD_SCRIPT, local_path, remote_path, resume))
+        try:
+            with open(local_path, 'rb') as file:
+                offset = self._resume_upload(file, size, resume)
+                self._send_pipelined(frames(file), progress, size)
+                sent = file.tell() - offset
+            self.repl.write(self._encode_frame(b''))
+        except Exception as e:
+            self._abandon_upload(e)
+            raise
+
+        self._finish_stream()
+        self.last_transfer = (sent, sent)
+        return sent
+
+    def listdir(self, path):
+        # Returns [(name, is_dir, size, mtime), ...] in a single round trip
+        with self._measure('list'):
+            response = self.repl.exec(LISTDIR_SCRIPT.format(path=path))
+        entries = []
+        for line in response.decode('utf-8', errors='replace').splitlines():
+            if not line:
+                continue
+            mode, size, mtime, name = line.split(' ', 3)
+            entries.append((name, int(mode) & 0x4000 != 0, int(size), int(mtime)))
+        return entries
+
+    def board_info(self):
+        # Rebuild the boot banner from os.uname() instead of soft-resetting the board
+        with self._measure('query'):
+            return self.repl.exec("import os; u = os.uname(); print('MicroPython %s; %s' % (u.version, u.machine))"
+                                  ).decode('utf-8', errors='replace').strip()
+
+    def probe(self):
+        # Returns (free heap, unique id or '', round-trip time of an empty
+        # command, best of three)
+        with self._measure('query'):
+            response = self.repl.exec(PROBE_SCRIPT).decode('utf-8', errors='replace')
+            mem_free, _, board_id = response.strip().partition(' ')
+            rtt = None
+            for _ in range(3):
+                start = time.perf_counter()
+                self.repl.exec('pass')
+                elapsed = time.perf_counter() - start
+                rtt = elapsed if rtt is None else min(rtt, elapsed)
+        return int(mem_free), board_id, rtt
+
+    def stat_mode(self, path):
+        # Returns the st_mode of a device path, or None if it does not exist
+        with self._measure('query'):
+            response = self.repl.exec(f"import os\ntry:\n print(os.stat({path!r})[0])\nexcept OSError:\n print(-1)")
+        mode = int(response)
+        return None if mode < 0 else mode
+
+    def stat_paths(self, paths):
+        # Returns {path: (st_mode, size)} for those of paths that exist, in
+        # one round trip
+        paths = list(paths)
+        if not paths:
+            return {}
+        with self._measure('query'):
+            response = self.repl.exec(STAT_SCRIPT.format(paths=paths))
+        stats = {}
+        for path, line in zip(paths, response.decode().splitlines()):
+            mode, size = map(int, line.split())
+            if mode >= 0:
+                stats[path] = (mode, size)
+        return stats
+
+    def mpy_target(self):
+        # Returns (mpy version, sub-version, native arch or None) of the .mpy
+        # files the board loads, or None if it doesn't say; queried once per
+        # connection
+        if self._mpy_target is False:
+            with self._measure('query'):
+                value = int(self.repl.exec(MPY_TARGET_SCRIPT))
+            arch = value >> 10
+            self._mpy_target = None if value < 0 else (
+                value & 0xFF, value >> 8 & 3, MPY_ARCHS[arch] if arch < len(MPY_ARCHS) else None)
+        return self._mpy_target
+
+    def free_space(self):
+        with self._measure('query'):
+            return int(self.repl.exec("import os; s = os.statvfs('/'); print(s[0] * s[3])"))
+
+    def hash_files(self, paths):
+        # Returns {path: sha256 hex} computed on the device in one round trip
+        with self._measure('hash'):
+            response = self.repl.exec(HASH_SCRIPT.format(paths=list(paths)))
+        hashes = {}
+        for line in response.decode('utf-8', errors='replace').splitlines():
+            if line:
+                digest, path = line.split(' ', 1)
+                hashes[path] = digest
+        return hashes
+
+    def makedirs(self, paths):
+        # Parents must come before children; existing directories are ignored
+        with self._measure('mkdir'):
+            self.repl.exec(MAKEDIRS_SCRIPT.format(paths=list(paths)))
+
+    def remove(self, files, dirs=()):
+        # Directories are only removed once empty, so list them deepest first
+        with self._measure('delete'):
+            self.repl.exec(REMOVE_SCRIPT.format(files=list(files), dirs=list(dirs)))
+
+    def remove_tree(self, paths, progress=None):
+        # Removes files and directories with everything below them in one
+        # command; progress(removed, 0) follows the running count. Returns
+        # the number of entries removed.
+        paths = [path.rstrip('/') for path in paths]
+        if '' in paths:
+            raise ValueError("Refusing to remove the root directory")
+        with self._measure('delete'):
+            self.repl.exec_raw_no_follow(REMOVE_TREE_SCRIPT.format(paths=paths))
+            removed = 0
+            try:
+                while True:
+                    line = self._read_stream_line()
+                    if not line:
+                        break
+                    removed = int(line)
+                    if progress:
+                        progress(removed, 0)
+            except Exception:
+                self.repl.in_raw_repl = False
+                raise
+            self._finish_stream()
+        return removed
+
+    def _read_stream_line(self):
+        line = self.repl.read_until(b'\n')
+        if b'\x04' in line:
+            # Script ended early: the rest of the line starts its traceback
+            stderr = line.split(b'\x04', 1)[1] + b'\n' + self.repl.read_until(b'\x04')
+            raise MicroPythonError(stderr.decode('utf-8', errors='replace').strip())
+        return line.strip()
+
+    def _sender_script(self, compressed=False, resume=False):
+        chunk_size = self.transfer_chunk()
+        writer = (FRAME_WRITE_RAW if self.encoding == 'raw' else FRAME_WRITE_BASE64) + DIGEST_SCRIPT
+        if resume:
+            writer += PREFIX_DIGEST_SCRIPT
+        if compressed:
+            return writer + SEND_DEFLATE_SCRIPT.format(chunk_size=chunk_size, wbits=self.COMPRESS_WBITS)
+        return writer + SEND_SCRIPT.format(chunk_size=chunk_size)
+
+    def _receive_frame(self):
+        if self.encoding == 'raw':
+            header = self.repl.read_exact(3)
+            if header[0:1] != b'\x06':
+                raise ReplError(f"Unexpected frame header during download: {header!r}")
+            return self.repl.read_exact(int.from_bytes(header[1:], 'little'))
+        return base64.b64decode(self._read_stream_line())
+
+    def _receive_file(self, file, size, progress=None, compressed=False, digest=None, offset=0):
+        # Writes a sent file's frames to file and checks them against the
+        # digest line that follows; digest is a sha256 object already fed
+        # with the first offset bytes. Returns (file bytes, payload bytes on
+        # the link).
+        decompressor = zlib.decompressobj() if compressed else None
+        digest = digest or hashlib.sha256()
+        received = wire = 0
+        while True:
+            chunk = self._receive_frame()
+            if not chunk:
+                if decompressor:
+                    chunk = decompressor.flush()
+                    file.write(chunk)
+                    digest.update(chunk)
+                break
+            wire += len(chunk)
+            if decompressor:
+                chunk = decompressor.decompress(chunk)
+            file.write(chunk)
+            digest.update(chunk)
+            received += len(chunk)
+            if progress:
+                progress(offset + received, size)
+        if self._read_stream_line().decode() != digest.hexdigest():
+            raise VerificationError(f"Received file does not match the device's (sent {received} bytes)")
+        return received, wire
+
+    def _finish_stream(self):
+        _, stderr = self.repl.follow()
+        if stderr:
+            raise MicroPythonError(stderr.decode('utf-8', errors='replace').strip())
+
+    def get(self, remote_path, local_path, progress=None):
+        # Downloads are streamed without acknowledgements, so the tuner only
+        # sets their frame size and backs off on errors
+        with self._measure('download') as op:
+            while True:
+                try:
+                    op.payload = self._get_file(remote_path, local_path, progress, op)
+                    return op.payload
+                except (ReplTimeout, MicroPythonError) as e:
+                    if not self._retry(e, op):
+                        raise
+
+    def _get_file(self, remote_path, local_path, progress, op):
+        if self._compressed_downloads():
+            try:
+                return self._get(remote_path, local_path, progress, compressed=True)
+            except MicroPythonError:
+                op.retries += 1
+                received = self._get(remote_path, local_path, progress)
+                self._compression = (self._compression[0], False)
+                return received
+        return self._get(remote_path, local_path, progress)
+
+    def _get(self, remote_path, local_path, progress=None, compressed=False):
+        # Received into <local_path>.mpf-part, which a later attempt resumes
+        # from, and moved over local_path once verified
+        part = local_path + self.PART_SUFFIX
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        self.repl.exec_raw_no_follow(self._sender_script(compressed, offset > 0) +
+                                     DOWNLOAD_SCRIPT.format(path=remote_path, offset=offset))
+        try:
+            size, offset = map(int, self._read_stream_line().split())
+            with open(part, 'r+b' if offset else 'wb') as file:
+                digest = sha256_read(file, offset)
+                file.truncate()
+                received, wire = self._receive_file(file, size, progress, compressed, digest, offset)
+        except VerificationError:
+            os.remove(part)
+            self.repl.in_raw_repl = False
+            if offset:
+                # The partial file was stale; start over
+                return self._get(remote_path, local_path, progress, compressed)
+            raise
+        except Exception:
+            self.repl.in_raw_repl = False
+            raise
+        self._finish_stream()
+        os.replace(part, local_path)
+        self.resumed_from = offset
+        self.last_transfer = (received, wire)
+        return received
+
+    def _walk_entries(self):
+        while True:
+            line = self._read_stream_line()
+            if not line:
+                return
+            mode, size, mtime, path = line.decode('utf-8', errors='replace').split(' ', 3)
+            yield path, int(mode) & 0x4000 != 0, int(size), int(mtime)
+
+    def walk(self, path):
+        # Yields (path, is_dir, size, mtime) for the whole tree as the device
+        # walks it. Abandoning the generator early interrupts the device script.
+        with self._measure('list'):
+            self.repl.exec_raw_no_follow('send = None\n' + WALK_SCRIPT.format(path=path))
+            try:
+                yield from self._walk_entries()
+            except (Exception, GeneratorExit):
+                self.repl.in_raw_repl = False
+                raise
+            self._finish_stream()
+
+    def search(self, path, glob='*', pattern=b''):
+        # Yields (path, offset, line) for files below path whose name matches
+        # glob and, with a byte pattern, for each place it occurs in them
+        # (offset None and line b'' otherwise), as the device finds them.
+        # Only matches cross the link. Abandoning the generator early
+        # interrupts the device script.
+        with self._measure('search'):
+            self.repl.exec_raw_no_follow(SEARCH_SCRIPT.format(path=path, glob=glob, pattern=bytes(pattern)))
+            try:
+                while True:
+                    line = self._read_stream_line()
+                    if not line:
+                        break
+                    offset, snippet, match_path = line.decode('utf-8', errors='replace').split('\t', 2)
+                    offset = int(offset)
+                    yield (match_path, None if offset < 0 else offset,
+                           ast.literal_eval(snippet) if snippet else b'')
+            except (Exception, GeneratorExit):
+                self.repl.in_raw_repl = False
+                raise
+            self._finish_stream()
+
+    def get_tree(self, remote_path, local_path, progress=None):
+        # Downloads a whole tree in one command; each file is written as soon
+        # as the walk reaches it. progress(path, size) is called per file.
+        with self._measure('download') as op:
+            return self._get_tree(remote_path, local_path, progress, op)
+
+    def _get_tree(self, remote_path, local_path, progress, op):
+        prefix = remote_path.rstrip('/') + '/'
+        compressed = self._compressed_downloads()
+        self.repl.exec_raw_no_follow(self._sender_script(compressed) + WALK_SCRIPT.format(path=remote_path))
+        files = []
+        try:
+            for path, is_dir, size, mtime in self._walk_entries():
+                local_file = os.path.join(local_path, *path[len(prefix):].split('/'))
+                if is_dir:
+                    os.makedirs(local_file, exist_ok=True)
+                    continue
+                os.makedirs(os.path.dirname(local_file), exist_ok=True)
+                with open(local_file + self.PART_SUFFIX, 'wb') as file:
+                    op.payload += self._receive_file(file, size, compressed=compressed)[0]
+                os.replace(local_file + self.PART_SUFFIX, local_file)
+                files.append(path)
+                if progress:
+                    progress(path, size)
+        except Exception:
+            self.repl.in_raw_repl = False
+            raise
+        self._finish_stream()
+        return files
+
+
+def cache_dir(name):
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'mpfiles', name)
+
+
+# Cross-compiles .py sources to .mpy before upload, so the board neither
+# receives the larger source nor compiles it on every import. The command
+# defaults to mpy-cross; any command taking mpy-cross's arguments works.
+# Results are cached by source hash, compiler version and target, so
+# unchanged files are never recompiled.
+class MpyCompiler:
+    # The board runs these by name, as source
+    KEEP_SOURCE = ('boot.py', 'main.py')
+
+    def __init__(self, command='mpy-cross', cache_root=None):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.cache_root = cache_root or cache_dir('mpy')
+        self._version = None
+
+    def _run(self, args):
+        try:
+            result = subprocess.run(self.command + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60)
+        except FileNotFoundError:
+            raise CompileError(f"{self.command[0]} not found; install it (pip install mpy-cross) "
+                               "or configure the compiler command")
+        except subprocess.TimeoutExpired:
+            raise CompileError(f"{self.command[0]} timed out")
+        if result.returncode:
+            output = (result.stderr or result.stdout).decode('utf-8', errors='replace').strip()
+            raise CompileError(output or f"{self.command[0]} exited with status {result.returncode}")
+        return result.stdout.decode('utf-8', errors='replace')
+
+    def version(self):
+        # e.g. "MicroPython v1.22.0 on 2024-01-01; mpy-cross emitting mpy v6.2"
+        if self._version is None:
+            self._version = (self._run(['--version']).strip().splitlines() or [''])[0]
+        return self._version
+
+    def mpy_version(self):
+        # (version, sub-version) of the output, or None if the compiler doesn't say
+        match = re.search(r'mpy v(\d+)(?:\.(\d+))?', self.version())
+        return (int(match.group(1)), int(match.group(2) or 0)) if match else None
+
+    def compiles(self, path):
+        return path.endswith('.py') and path.rsplit('/', 1)[-1] not in self.KEEP_SOURCE
+
+    def compile(self, source_path, arch=None):
+        # Returns the path of the cached .mpy for source_path
+        name = os.path.basename(source_path)
+        key = hashlib.sha256('\0'.join((self.version(), ' '.join(self.command), arch or '', name)).encode())
+        with open(source_path, 'rb') as file:
+            key.update(file.read())
+        digest = key.hexdigest()
+        directory = os.path.join(self.cache_root, digest[:2])
+        path = os.path.join(directory, digest + '.mpy')
+        if os.path.exists(path):
+            return path
+
+        os.makedirs(directory, exist_ok=True)
+        # Written under a temporary name, so parallel syncs never see half a file
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        os.close(fd)
+        try:
+            self._run(['-o', temp_path, '-s', name] + (['-march=' + arch] if arch else []) + [source_path])
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
+
+    def prepare(self, device_fs, local_path, remote_path):
+        # Returns (file to upload, device path): the cached .mpy and the .mpy
+        # path for compilable sources, otherwise both unchanged
+        if not self.compiles(remote_path):
+            return local_path, remote_path
+        target = device_fs.mpy_target()
+        if target is None:
+            return local_path, remote_path
+        version = self.mpy_version()
+        if version and version[0] != target[0]:
+            raise CompileError(f"{self.command[0]} emits mpy v{version[0]} but the board loads v{target[0]}; "
+                               "use a matching mpy-cross")
+        # Native code also needs a matching sub-version; plain bytecode doesn't
+        arch = target[2] if version and version[1] == target[1] else None
+        return self.compile(local_path, arch), remote_path[:-3] + '.mpy'
+
+    def put(self, device_fs, local_path, remote_path, progress=None, remove_source=True):
+        # Uploads a file, compiled when possible; returns the device path
+        # written. Without remove_source the caller deals with a source left
+        # at remote_path.
+        upload_path, target_path = self.prepare(device_fs, local_path, remote_path)
+        device_fs.put(upload_path, target_path, progress)
+        if remove_source and target_path != remote_path and device_fs.stat_mode(remote_path) is not None:
+            # A source left next to its .mpy would still be imported first
+            device_fs.remove([remote_path])
+        return target_path
+
+
+def sha256_file(path):
+    with open(path, 'rb') as file:
+        return sha256_read(file).hexdigest()
+
+
+def sha256_read(file, size=None):
+    # Hashes the next size bytes of file (the rest of it when None)
+    h = hashlib.sha256()
+    while size is None or size > 0:
+        chunk = file.read(65536 if size is None else min(size, 65536))
+        if not chunk:
+            break
+        h.update(chunk)
+        if size is not None:
+            size -= len(chunk)
+    return h
+
+
+# Persistent index of a local folder, {rel: (size, mtime_ns, inode, sha256)},
+# kept per folder in the cache directory. scan() lists the folder with
+# os.scandir and keeps the hashes of files whose stat signature is unchanged,
+# so planning a sync of an unchanged tree reads no file contents. Hashes are
+# computed on demand.
+class LocalIndex:
+    VERSION = 1
+    # A file changed this recently (ns) could change again within the same
+    # mtime tick, so its hash is not kept
+    RACY_NS = 2 * 10 ** 9
+
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        if path:
+            self.load()
+
+    @classmethod
+    def open(cls, root, cache_root=None):
+        root = os.path.abspath(root)
+        key = hashlib.sha1(os.path.normcase(root).encode()).hexdigest()[:16]
+        return cls(root, os.path.join(cache_root or cache_dir('index'), key + '.json'))
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.VERSION and data.get('root') == self.root:
+            self.entries = {rel: tuple(entry) for rel, entry in data['files'].items()}
+
+    def save(self):
+        with self.lock:
+            if not (self.path and self.dirty):
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as file:
+                json.dump({'version': self.VERSION, 'root': self.root, 'files': self.entries}, file,
+                          separators=(',', ':'))
+            os.replace(temp_path, self.path)
+            self.dirty = False
+
+    def scan(self):
+        # Returns ({rel: size}, {rel dir}) like os.walk would find them
+        # (symlinked directories are listed but not entered); files that are
+        # gone are dropped from the index
+        files, dirs, entries = {}, set(), {}
+        stack = [('', self.root)] if os.path.isdir(self.root) else []
+        with self.lock:
+            while stack:
+                prefix, directory = stack.pop()
+                with os.scandir(directory) as scan:
+                    for entry in scan:
+                        rel = prefix + entry.name
+                        if entry.is_dir():
+                            dirs.add(rel)
+                            if not entry.is_symlink():
+                                stack.append((rel + '/', entry.path))
+                            continue
+                        if entry.name.endswith(DeviceFS.PART_SUFFIX):
+                            continue
+                        st = entry.stat()
+                        signature = (st.st_size, st.st_mtime_ns, entry.inode())
+                        known = self.entries.get(rel)
+                        entries[rel] = known if known and tuple(known[:3]) == signature else signature + (None,)
+                        files[rel] = st.st_size
+            if entries != self.entries:
+                self.entries = entries
+                self.dirty = True
+        return files, dirs
+
+    def hash(self, rel):
+        # SHA-256 hex of a file found by scan(), from the index when its
+        # signature hasn't changed since
+        with self.lock:
+            known = self.entries.get(rel)
+        if known and known[3]:
+            return known[3]
+        path = os.path.join(self.root, *rel.split('/'))
+        st = os.stat(path)
+        digest = sha256_file(path)
+        signature = (st.st_size, st.st_mtime_ns, st.st_ino)
+        # time.time_ns() needs 3.7; float seconds are precise enough here
+        if time.time() * 1e9 - st.st_mtime_ns > self.RACY_NS:
+            with self.lock:
+                self.entries[rel] = signature + (digest,)
+                self.dirty = True
+        return digest
+
+
+# Differential sync between a local folder and a device folder. plan() compares
+# both trees by size, then by SHA-256 (computed on the device for the remote
+# side), and returns (action, relative path) tuples; apply() carries them out.
+# Actions always target the destination side: mkdir, upload/download, delete, rmdir.
+class SyncEngine:
+    def __init__(self, device_fs, local_root, remote_root, to_board, delete=False, compiler=None, index=None):
+        self.device_fs = device_fs
+        self.local_root = local_root
+        # LocalIndex of local_root; pass a persistent one (LocalIndex.open)
+        # to keep hashes between syncs
+        self.index = index or LocalIndex(local_root)
+        self.remote_root = remote_root.rstrip('/')
+        self.to_board = to_board
+        self.delete = delete
+        # MpyCompiler: .py files go to the board as .mpy (to_board only)
+        self.compiler = compiler if to_board else None
+        self.local_files = {}
+        self.remote_files = {}
+        self.create_root = False
+        # Compiled files: {.mpy rel: cached .mpy path} and {.mpy rel: .py rel}
+        self.compiled = {}
+        self.sources = {}
+
+    def remote_path(self, rel):
+        return f"{self.remote_root}/{rel}"
+
+    def local_path(self, rel):
+        if rel in self.compiled:
+            return self.compiled[rel]
+        return os.path.join(self.local_root, *rel.split('/'))
+
+    def local_manifest(self):
+        files, dirs = self.index.scan()
+        if not self.compiler:
+            return files, dirs
+        compiled_files = {}
+        for rel, size in files.items():
+            path, compiled_rel = self.compiler.prepare(self.device_fs, self.local_path(rel), rel)
+            if compiled_rel != rel:
+                self.compiled[compiled_rel] = path
+                self.sources[compiled_rel] = rel
+                rel, size = compiled_rel, os.path.getsize(path)
+            compiled_files[rel] = size
+        return compiled_files, dirs
+
+    def local_hash(self, rel):
+        if rel in self.compiled:
+            return sha256_file(self.compiled[rel])
+        return self.index.hash(rel)
+
+    def remote_manifest(self):
+        files, dirs = {}, set()
+        if self.to_board and self.remote_root and self.device_fs.stat_mode(self.remote_root) is None:
+            # Syncing into a new folder: created (with its parents) by apply
+            self.create_root = True
+            return files, dirs
+        prefix = self.remote_root + '/'
+        for path, is_dir, size, mtime in self.device_fs.walk(self.remote_root or '/'):
+            rel = path[len(prefix):]
+            if is_dir:
+                dirs.add(rel)
+            elif not rel.endswith(DeviceFS.PART_SUFFIX):
+                files[rel] = size
+        return files, dirs
+
+    def plan(self):
+        local_files, local_dirs = self.local_manifest()
+        remote_files, remote_dirs = self.remote_manifest()
+        self.local_files = local_files
+        self.remote_files = remote_files
+        if self.to_board:
+            src_files, src_dirs, dst_files, dst_dirs = local_files, local_dirs, remote_files, remote_dirs
+        else:
+            src_files, src_dirs, dst_files, dst_dirs = remote_files, remote_dirs, local_files, local_dirs
+
+        changed = [rel for rel, size in src_files.items() if dst_files.get(rel) != size]
+        same_size = [rel for rel in src_files if dst_files.get(rel) == src_files[rel]]
+        if same_size:
+            try:
+                remote_hashes = self.device_fs.hash_files(self.remote_path(rel) for rel in same_size)
+            except MicroPythonError:
+                # No usable hashlib on this firmware: treat same-size files as changed
+                remote_hashes = {}
+            for rel in same_size:
+                remote_hash = remote_hashes.get(self.remote_path(rel))
+                if remote_hash is None or remote_hash != self.local_hash(rel):
+                    changed.append(rel)
+        self.index.save()
+
+        actions = [('mkdir', d) for d in sorted(src_dirs - dst_dirs)]
+        copy_action = 'upload' if self.to_board else 'download'
+        actions += [(copy_action, rel) for rel in sorted(changed)]
+        if self.delete:
+            actions += [('delete', rel) for rel in sorted(set(dst_files) - set(src_files))]
+            # Reverse order puts children before their parents
+            actions += [('rmdir', d) for d in sorted(dst_dirs - src_dirs, reverse=True)]
+        else:
+            # A source left next to its .mpy would still be imported first
+            actions += [('delete', rel) for rel in sorted(self.sources.values()) if rel in dst_files]
+        return actions
+
+    def affected_remote_dirs(self, actions):
+        # Device directories whose listing changes when the actions are applied
+        if not self.to_board:
+            return set()
+        dirs = set()
+        for action, rel in actions:
+            path = self.remote_path(rel)
+            dirs.add(path.rsplit('/', 1)[0] or '/')
+            if action in ('mkdir', 'rmdir'):
+                dirs.add(path)
+        return dirs
+
+    def apply(self, actions, progress=None):
+        grouped = {}
+        for action, rel in actions:
+            grouped.setdefault(action, []).append(rel)
+
+        if self.to_board:
+            new_dirs = [self.remote_path(rel) for rel in grouped.get('mkdir', [])]
+            if self.create_root:
+                parts = self.remote_root.strip('/').split('/')
+                new_dirs = ['/' + '/'.join(parts[:i + 1]) for i in range(len(parts))] + new_dirs
+            if new_dirs:
+                self.device_fs.makedirs(new_dirs)
+            for rel in grouped.get('upload', []):
+                self.device_fs.put(self.local_path(rel), self.remote_path(rel))
+                if progress:
+                    progress('upload', rel)
+            if grouped.get('delete') or grouped.get('rmdir'):
+                self.device_fs.remove([self.remote_path(rel) for rel in grouped.get('delete', [])],
+                                      [self.remote_path(rel) for rel in grouped.get('rmdir', [])])
+            return
+
+        for rel in grouped.get('mkdir', []):
+            os.makedirs(self.local_path(rel), exist_ok=True)
+        downloads = grouped.get('download', [])
+        if downloads and set(downloads) == set(self.remote_files):
+            # Everything is needed: stream the whole tree in one command
+            self.device_fs.get_tree(self.remote_root or '/', self.local_root,
+                                    progress and (lambda path, size: progress('download', path[len(self.remote_root) + 1:])))
+        else:
+            for rel in downloads:
+                self.device_fs.get(self.remote_path(rel), self.local_path(rel))
+                if progress:
+                    progress('download', rel)
+        for rel in grouped.get('delete', []):
+            os.remove(self.local_path(rel))
+        for rel in grouped.get('rmdir', []):
+            try:
+                os.rmdir(self.local_path(rel))
+            except OSError:
+                pass
+
+
+# One copy between the host and the board. source and destination are in
+# transfer order: a local and a device path for uploads, the reverse for
+# downloads.
+class Transfer:
+    def __init__(self, direction, source, destination, size=0, overwrite=False):
+        self.direction = direction
+        self.source = source
+        self.destination = destination
+        self.size = size
+        # Bytes of this file copied so far
+        self.done = 0
+        # Whether the destination already exists (set by prefetch), and
+        # whether replacing it was already confirmed
+        self.exists = False
+        self.overwrite = overwrite
+        # queued, skipped, running, done, failed or cancelled
+        self.state = 'queued'
+        self.error = None
+        self.resumed_from = 0
+        # (file bytes, payload bytes on the link) once done, as in
+        # DeviceFS.last_transfer
+        self.transferred = (0, 0)
+
+    @property
+    def remote_path(self):
+        return self.destination if self.direction == 'upload' else self.source
+
+    @property
+    def local_path(self):
+        return self.source if self.direction == 'upload' else self.destination
+
+
+# Collects uploads and downloads and hands them out in batches. Queuing a
+# transfer to a destination that is already pending replaces the pending one,
+# so dropping the same file twice copies it once.
+class TransferQueue:
+    def __init__(self):
+        self.pending = OrderedDict()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, direction, source, destination, size=0, overwrite=False):
+        # Returns the transfers that were not already pending. A local folder
+        # queued for upload is queued file by file; a device folder queued
+        # for download is expanded by prefetch.
+        if direction == 'upload' and os.path.isdir(source):
+            added = []
+            for dirpath, dirnames, filenames in os.walk(source):
+                dirnames.sort()
+                rel = os.path.relpath(dirpath, source)
+                base = destination if rel == '.' else f"{destination}/{rel.replace(os.sep, '/')}"
+                for name in sorted(filenames):
+                    if not name.endswith(DeviceFS.PART_SUFFIX):
+                        added += self.add(direction, os.path.join(dirpath, name), f"{base}/{name}",
+                                          overwrite=overwrite)
+            return added
+        key = (direction, destination)
+        transfer = self.pending.get(key)
+        if transfer is not None:
+            transfer.source, transfer.size, transfer.overwrite = source, size, overwrite
+            return []
+        transfer = self.pending[key] = Transfer(direction, source, destination, size, overwrite)
+        return [transfer]
+
+    def clear(self):
+        self.pending.clear()
+
+    def take(self):
+        batch = TransferBatch(list(self.pending.values()))
+        self.pending.clear()
+        return batch
+
+
+# Transfers run together in one device session: prefetch() looks up every
+# device path they touch in a single query, run() copies them in order. The
+# byte counts, rate and ETA cover the whole batch.
+class TransferBatch:
+    def __init__(self, transfers):
+        self.transfers = transfers
+        # Device folders created before the uploads, parents first
+        self.new_dirs = []
+        # Sources on the board that compiled uploads replace with a .mpy
+        self.old_sources = set()
+        self.started = None
+        self.finished = None
+
+    def __len__(self):
+        return len(self.transfers)
+
+    @staticmethod
+    def target(transfer, compiler=None):
+        # The device path an upload ends up at
+        path = transfer.destination
+        if compiler and compiler.compiles(path):
+            return path[:-3] + '.mpy'
+        return path
+
+    def prefetch(self, device_fs, compiler=None):
+        # Fills in sizes and whether destinations exist. Device folders queued
+        # for download are replaced by the files in them.
+        uploads = [t for t in self.transfers if t.direction == 'upload']
+        parents = set()
+        for transfer in uploads:
+            parts = transfer.destination.strip('/').split('/')[:-1]
+            parents.update('/' + '/'.join(parts[:i + 1]) for i in range(len(parts)))
+        paths = [self.target(t, compiler) if t.direction == 'upload' else t.source for t in self.transfers]
+        sources = [t.destination for t, path in zip(self.transfers, paths) if path != t.remote_path]
+        stats = device_fs.stat_paths(paths + sources + sorted(parents))
+        self.new_dirs = sorted(parents - set(stats))
+        self.old_sources = set(sources) & set(stats)
+
+        transfers = []
+        for transfer, path in zip(self.transfers, paths):
+            stat = stats.get(path)
+            if transfer.direction == 'upload':
+                transfer.size = os.path.getsize(transfer.source)
+                transfer.exists = stat is not None
+            elif stat is None:
+                transfer.state, transfer.error = 'failed', OSError(f"{path} not found")
+            elif stat[0] & 0x4000:
+                prefix = path.rstrip('/') + '/'
+                for entry, is_dir, size, mtime in device_fs.walk(path):
+                    if not is_dir and not entry.endswith(DeviceFS.PART_SUFFIX):
+                        child = Transfer('download', entry, os.path.join(transfer.destination,
+                                                                         *entry[len(prefix):].split('/')),
+                                         size, transfer.overwrite)
+                        child.exists = os.path.exists(child.destination)
+                        transfers.append(child)
+                continue
+            else:
+                transfer.size = stat[1]
+                transfer.exists = os.path.exists(transfer.destination)
+            transfers.append(transfer)
+        self.transfers = transfers
+
+    def existing(self):
+        # Transfers that would replace a file without having been confirmed
+        return [t for t in self.transfers if t.exists and not t.overwrite and t.state == 'queued']
+
+    def skip_existing(self):
+        for transfer in self.existing():
+            transfer.state = 'skipped'
+
+    def cancel(self):
+        for transfer in self.transfers:
+            if transfer.state in ('queued', 'running'):
+                transfer.state = 'cancelled'
+        self.finished = self.finished or time.monotonic()
+
+    def run(self, device_fs, progress=None, compiler=None):
+        # A transfer that fails is recorded and the rest still run, unless the
+        # board stopped answering. progress(transfer) follows every chunk.
+        self.started = time.monotonic()
+        if self.new_dirs:
+            device_fs.makedirs(self.new_dirs)
+        # A source left next to its .mpy would still be imported first
+        replaced = []
+        for transfer in self.transfers:
+            if transfer.state != 'queued':
+                continue
+            transfer.state = 'running'
+
+            def step(done, total, transfer=transfer):
+                transfer.done = min(done, transfer.size)
+                if progress:
+                    progress(transfer)
+
+            try:
+                if transfer.direction == 'download':
+                    os.makedirs(os.path.dirname(transfer.destination) or '.', exist_ok=True)
+                    device_fs.get(transfer.source, transfer.destination, step)
+                elif compiler:
+                    target = compiler.put(device_fs, transfer.source, transfer.destination, step, False)
+                    if target != transfer.destination and transfer.destination in self.old_sources:
+                        replaced.append(transfer.destination)
+                else:
+                    device_fs.put(transfer.source, transfer.destination, step)
+            except ReplCancelled:
+                transfer.state = 'cancelled'
+                raise
+            except (ReplError, MicroPythonError, CompileError, OSError) as e:
+                transfer.state, transfer.error = 'failed', e
+                if isinstance(e, ReplTimeout):
+                    raise
+            else:
+                transfer.state = 'done'
+                transfer.done = transfer.size
+                transfer.resumed_from = device_fs.resumed_from
+                transfer.transferred = device_fs.last_transfer
+            if progress:
+                progress(transfer)
+        if replaced:
+            device_fs.remove(replaced)
+        self.finished = time.monotonic()
+
+    def counts(self):
+        counts = {}
+        for transfer in self.transfers:
+            counts[transfer.state] = counts.get(transfer.state, 0) + 1
+        return counts
+
+    def progress(self):
+        # (bytes copied, bytes to copy) over the transfers not skipped or failed
+        copying = [t for t in self.transfers if t.state in ('queued', 'running', 'done')]
+        return sum(t.done for t in copying), sum(t.size for t in copying)
+
+    def rate(self):
+        # Bytes per second since the batch started
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.progress()[0] / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        # Seconds left at the current rate, or None before there is one
+        done, total = self.progress()
+        rate = self.rate()
+        return (total - done) / rate if rate else None
+
+    def affected_remote_dirs(self):
+        dirs = set()
+        for transfer in self.transfers:
+            if transfer.direction == 'upload':
+                dirs.add(transfer.destination.rsplit('/', 1)[0] or '/')
+        for path in self.new_dirs:
+            dirs.add(path.rsplit('/', 1)[0] or '/')
+        return dirs
+
+
+# Per-connection cache of device directory listings. Entries younger than ttl
+# are fresh; older ones are still returned (as stale) so the view can render
+# them immediately while a background listing revalidates them. The least
+# recently used entries are evicted beyond max_entries. Free space is a
+# device-wide value and is dropped on any invalidation.
+class ListingCache:
+    def __init__(self, max_entries=64, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.listings = OrderedDict()
+        self.free_space = None
+
+    @staticmethod
+    def key(path):
+        return path.rstrip('/') or '/'
+
+    def get(self, path):
+        # Returns (entries, is_fresh) or None
+        key = self.key(path)
+        item = self.listings.get(key)
+        if item is None:
+            return None
+        self.listings.move_to_end(key)
+        stamp, entries = item
+        return entries, time.monotonic() - stamp < self.ttl
+
+    def put(self, path, entries):
+        key = self.key(path)
+        self.listings[key] = (time.monotonic(), entries)
+        self.listings.move_to_end(key)
+        while len(self.listings) > self.max_entries:
+            self.listings.popitem(last=False)
+
+    def invalidate(self, *paths):
+        for path in paths:
+            self.listings.pop(self.key(path), None)
+        self.free_space = None
+
+    def invalidate_tree(self, path):
+        key = self.key(path)
+        prefix = key.rstrip('/') + '/'
+        for cached in [k for k in self.listings if k == key or k.startswith(prefix)]:
+            del self.listings[cached]
+        self.free_space = None
+
+    def clear(self):
+        self.listings.clear()
+        self.free_space = None
+
+
+# USB IDs that are only used by MicroPython firmware
+MICROPYTHON_USB_IDS = {
+    (0xF055, 0x9800),  # MicroPython VID: pyboard CDC+MSC
+    (0xF055, 0x9801),  # MicroPython VID: pyboard CDC+HID
+    (0xF055, 0x9802),  # MicroPython VID: CDC only
+    (0x2E8A, 0x0005),  # Raspberry Pi RP2 running MicroPython
+}
+
+
+# Finds MicroPython boards without resetting them. USB descriptors are checked
+# first (no I/O); the remaining ports are probed concurrently. Results are
+# kept per port until that port disappears or its hardware ID changes.
+class PortScanner:
+    def __init__(self, probe_timeout=0.5, max_workers=16):
+        self.probe_timeout = probe_timeout
+        self.max_workers = max_workers
+        self.cache = {}
+
+    @staticmethod
+    def port_key(port):
+        return port.device, port.hwid
+
+    @staticmethod
+    def matches_descriptor(port):
+        if port.vid is not None and ((port.vid, port.pid) in MICROPYTHON_USB_IDS or port.vid == 0xF055):
+            return True
+        text = f"{port.manufacturer or ''} {port.product or ''} {port.description or ''}"
+        return 'MicroPython' in text
+
+    def probe(self, device):
+        try:
+            with serial.Serial(device, 115200, timeout=0.05, write_timeout=0.5) as ser:
+                # Ctrl-C stops a running program and Ctrl-B makes the friendly
+                # REPL print its banner; unlike Ctrl-D neither resets the board
+                ser.write(b'\r\x03\x03\x02')
+                response = b''
+                deadline = time.monotonic() + self.probe_timeout
+                while time.monotonic() < deadline and b'>>>' not in response:
+                    response += ser.read(ser.in_waiting or 1)
+                return b'MicroPython' in response
+        except (serial.SerialException, OSError):
+            return False
+
+    def scan(self, skip=()):
+        # Returns [(device, is_micropython), ...]; ports in skip are assumed to
+        # be MicroPython boards that are already open
+        ports = serial.tools.list_ports.comports()
+        keys = {self.port_key(port) for port in ports}
+        self.cache = {key: found for key, found in self.cache.items() if key in keys}
+
+        to_probe = []
+        for port in ports:
+            key = self.port_key(port)
+            if port.device in skip or key in self.cache:
+                continue
+            if self.matches_descriptor(port):
+                self.cache[key] = True
+            else:
+                to_probe.append(port)
+
+        if to_probe:
+            # Imported here: concurrent.futures pulls in logging, which is a
+            # noticeable part of the command line's startup time
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(to_probe))) as pool:
+                for port, found in zip(to_probe, pool.map(lambda port: self.probe(port.device), to_probe)):
+                    self.cache[self.port_key(port)] = found
+
+        return [(port.device, port.device in skip or self.cache[self.port_key(port)]) for port in ports]
+
+
+# Runs the same sync-to-board on many boards at once: one thread per board,
+# at most max_workers at a time. Each board gets its own connection and plan,
+# and failures are retried up to `retries` times. progress(port, state, done,
+# total, message) is called from the worker threads with state one of
+# 'connecting', 'syncing', 'retrying', 'done', 'failed'.
+class FleetSync:
+    def __init__(self, local_root, remote_root, delete=False, max_workers=8, retries=1, retry_delay=2.0,
+                 device_options=None, compiler=None):
+        self.local_root = local_root
+        self.remote_root = remote_root
+        self.delete = delete
+        self.compiler = compiler
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.device_options = device_options or {}
+        self.stop_event = threading.Event()
+        # Shared by the boards' sync engines, so each local file is hashed once
+        self.index = LocalIndex.open(local_root)
+
+    def stop(self):
+        # Interrupts transfers in progress; boards not yet started are skipped
+        self.stop_event.set()
+
+    def sync_one(self, port, progress):
+        progress(port, 'connecting', 0, 0, '')
+        device_fs = open_device(port, cancel_event=self.stop_event, **self.device_options)
+        try:
+            engine = SyncEngine(device_fs, self.local_root, self.remote_root, to_board=True, delete=self.delete,
+                                compiler=self.compiler, index=self.index)
+            actions = engine.plan()
+            done = 0
+            progress(port, 'syncing', done, len(actions), '')
+
+            def step(action, rel):
+                nonlocal done
+                done += 1
+                progress(port, 'syncing', done, len(actions), f"{action} {rel}")
+
+            engine.apply(actions, step)
+            return len(actions)
+        finally:
+            close_device(device_fs)
+
+    def sync_with_retries(self, port, progress):
+        for attempt in range(self.retries + 1):
+            if self.stop_event.is_set():
+                error = ReplCancelled("Operation cancelled")
+                break
+            try:
+                count = self.sync_one(port, progress)
+            except Exception as e:
+                error = e
+                if attempt < self.retries and not self.stop_event.is_set():
+                    progress(port, 'retrying', 0, 0, str(e))
+                    # Give a board that reset or re-enumerated time to come back
+                    self.stop_event.wait(self.retry_delay)
+            else:
+                progress(port, 'done', count, count, f"{count} action(s)")
+                return None
+        progress(port, 'failed', 0, 0, str(error))
+        return error
+
+    def run(self, ports, progress=None):
+        # Returns {port: None on success, else the last error}
+        progress = progress or (lambda *args: None)
+        if not ports:
+            return {}
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(ports))) as pool:
+            errors = pool.map(lambda port: self.sync_with_retries(port, progress), ports)
+            return dict(zip(ports, errors))
+
+
+def open_device(port, chunk_size=2048, encoding='base64', compress=True, window=None, cancel_event=None,
+                metrics=None, adaptive=False):
+    # Opens the port, enters the raw REPL and returns a DeviceFS for it. With
+    # adaptive, the board is probed for free memory and round-trip time and
+    # transfers are sized by a ChunkTuner starting at chunk_size.
+    ser = serial.Serial(port, 115200, timeout=1, write_timeout=5)
+    try:
+        repl = RawRepl(ser)
+        repl.cancel_event = cancel_event
+        repl.enter()
+        device_fs = DeviceFS(repl, chunk_size=chunk_size, encoding=encoding, compress=compress, window=window,
+                             metrics=metrics)
+        if adaptive:
+            mem_free, device_fs.board_id, rtt = device_fs.probe()
+            device_fs.tuner = ChunkTuner(chunk_size)
+            device_fs.tuner.fit(mem_free, rtt)
+    except Exception:
+        ser.close()
+        raise
+    if metrics is not None:
+        metrics.attach(repl)
+    return device_fs
+
+
+def close_device(device_fs):
+    try:
+        # Leave the board in the friendly REPL
+        device_fs.repl.exit()
+    except serial.SerialException:
+        pass
+    device_fs.repl.serial.close()
+    if device_fs.metrics is not None:
+        device_fs.metrics.detach(device_fs.repl)
@@ -1,55 +1,310 @@
 import sys
 import os
-import serial
-import serial.tools.list_ports
-import ast
 import time
 import shutil
+import threading
+import queue
+import bisect
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
                              QPushButton, QLabel, QStatusBar, QComboBox, QFileSystemModel, 
                              QTreeView, QHeaderView, QMessageBox, QInputDialog, QFileDialog,
-                             QSplitter, QAbstractItemView, QLineEdit, QToolButton)
-from PyQt5.QtCore import Qt, QTimer, QDir, QByteArray, QMimeData, QUrl, QRectF, QSettings, QSize
+                             QSplitter, QAbstractItemView, QLineEdit, QToolButton, QCheckBox,
+                             QProgressBar, QDialog, QTableWidget, QTableWidgetItem, QSpinBox, QDockWidget)
+from PyQt5.QtCore import Qt, QTimer, QDir, QByteArray, QMimeData, QUrl, QRectF, QSettings, QSize, QThread, pyqtSignal
 from PyQt5.QtGui import QIcon, QDragEnterEvent, QDropEvent, QPainter, QPixmap
 from PyQt5.QtSvg import QSvgRenderer
 
 import tempfile
 
 from PyQt5.QtCore import QAbstractItemModel, QModelIndex, Qt, QDateTime
-from PyQt5.QtGui import QStandardItem, QStandardItemModel
 
-class MicroPythonFileModel(QStandardItemModel):
+from mpcore import (ReplTimeout, ReplCancelled, MicroPythonError, SyncEngine, FleetSync, LocalIndex, Metrics,
+                    MpyCompiler, ListingCache, PortScanner, Transfer, TransferQueue, TransferBatch, open_device,
+                    close_device)
+
+
+# A unit of work for TransportWorker. fn(job) runs on the worker thread;
+# on_done(result), on_error(exception) and on_cancel() run on the GUI thread.
+class Job:
+    def __init__(self, kind, fn, on_done=None, on_error=None, on_cancel=None):
+        self.kind = kind
+        self.fn = fn
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.cancel_event = threading.Event()
+        self.worker = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def report(self, done, total, message=''):
+        if self.cancelled:
+            raise ReplCancelled("Operation cancelled")
+        self.worker.job_progress.emit(self, done, total, message)
+
+
+# Owns the serial port and runs queued jobs one at a time, so serial I/O
+# never blocks the Qt event loop
+class TransportWorker(QThread):
+    job_progress = pyqtSignal(object, object, object, str)
+    job_finished = pyqtSignal(object, object)
+    job_failed = pyqtSignal(object, object)
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setHorizontalHeaderLabels(['Name', 'Size', 'Type', 'Last Modified'])
-        self.root_path = '/'
-
-    def refresh(self, file_list, is_dir_list, size_list, mtime_list):
-        self.clear()
-        self.setHorizontalHeaderLabels(['Name', 'Size', 'Type', 'Last Modified'])
-        for name, is_dir, size, mtime in zip(file_list, is_dir_list, size_list, mtime_list):
-            name_item = QStandardItem(name)
-            size_item = QStandardItem(str(size) if not is_dir else '')
-            type_item = QStandardItem('Directory' if is_dir else 'File')
-            mtime_item = QStandardItem(QDateTime.fromSecsSinceEpoch(mtime).toString("yyyy-MM-dd HH:mm:ss"))
-            self.appendRow([name_item, size_item, type_item, mtime_item])
-
-    def set_root_path(self, path):
-        self.root_path = path
+        self.jobs = queue.Queue()
+        self.current = None
+        self.serial = None
+        self.repl = None
+        self.device_fs = None
 
-    def filePath(self, index):
+    def submit(self, job):
+        job.worker = self
+        self.jobs.put(job)
+        return job
+
+    def cancel_all(self):
+        while True:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self.jobs.put(None)
+                break
+            job.cancel()
+            self.job_failed.emit(job, ReplCancelled("Operation cancelled"))
+        current = self.current
+        if current is not None:
+            current.cancel()
+
+    def stop(self):
+        self.jobs.put(None)
+        self.wait()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                self.job_failed.emit(job, ReplCancelled("Operation cancelled"))
+                continue
+            self.current = job
+            if self.repl:
+                self.repl.cancel_event = job.cancel_event
+            try:
+                result = job.fn(job)
+            except Exception as e:
+                self.job_failed.emit(job, e)
+            else:
+                self.job_finished.emit(job, result)
+            finally:
+                self.current = None
+
+    # The methods below must only be called from jobs
+    def open(self, port, chunk_size, encoding, compress=False, window=None, metrics=None, adaptive=False):
+        self.close()
+        self.device_fs = open_device(port, chunk_size, encoding, compress, window,
+                                     cancel_event=self.current.cancel_event if self.current else None,
+                                     metrics=metrics, adaptive=adaptive)
+        self.repl = self.device_fs.repl
+        self.serial = self.repl.serial
+
+    def close(self):
+        if self.device_fs:
+            close_device(self.device_fs)
+        self.serial = None
+        self.repl = None
+        self.device_fs = None
+
+
+class FileNode:
+    __slots__ = ('name', 'is_dir', 'size', 'mtime', 'parent', 'row', 'children', 'loaded', 'fetching')
+
+    def __init__(self, name, is_dir, size=0, mtime=0, parent=None):
+        self.name = name
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.parent = parent
+        self.row = 0
+        self.children = []
+        self.loaded = False
+        self.fetching = False
+
+    def sort_key(self):
+        return not self.is_dir, self.name.lower()
+
+
+# The device filesystem as a lazily loaded tree. Directories are listed when
+# the view expands them (fetch_requested is emitted; the window answers with
+# apply_listing), and listings are merged as row inserts, removals and
+# dataChanged so expansion and selection survive a refresh.
+class MicroPythonFileModel(QAbstractItemModel):
+    HEADERS = ['Name', 'Size', 'Type', 'Last Modified']
+
+    fetch_requested = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.root = FileNode('', True)
+
+    def clear(self):
+        self.beginResetModel()
+        self.root = FileNode('', True)
+        self.endResetModel()
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self.root
+
+    def index(self, row, column, parent=QModelIndex()):
+        node = self.node(parent)
+        if not 0 <= row < len(node.children) or not 0 <= column < len(self.HEADERS):
+            return QModelIndex()
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
         if not index.isValid():
-            return self.root_path
-        path = self.root_path
-        while index.isValid():
-            path = f"{path}/{index.data()}"
-            index = index.parent()
-        return path
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self.root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        return len(self.node(parent).children)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.HEADERS)
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        if not node.is_dir:
+            return False
+        return bool(node.children) or not node.loaded
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return node.is_dir and not node.loaded and not node.fetching
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        node.fetching = True
+        self.fetch_requested.emit(self.node_path(node))
+
+    def fetch_failed(self, path):
+        node = self.find_node(path)
+        if node is not None:
+            node.fetching = False
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        node = index.internalPointer()
+        column = index.column()
+        if column == 0:
+            return node.name
+        if column == 1:
+            return '' if node.is_dir else str(node.size)
+        if column == 2:
+            return 'Directory' if node.is_dir else 'File'
+        return QDateTime.fromSecsSinceEpoch(node.mtime).toString("yyyy-MM-dd HH:mm:ss")
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def node_index(self, node):
+        if node is self.root or node is None:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def node_path(self, node):
+        names = []
+        while node is not None and node is not self.root:
+            names.append(node.name)
+            node = node.parent
+        return '/' + '/'.join(reversed(names))
+
+    def find_node(self, path, create=False):
+        node = self.root
+        for name in [part for part in path.split('/') if part]:
+            child = next((c for c in node.children if c.name == name), None)
+            if child is None:
+                if not create:
+                    return None
+                # Placeholder for a directory reached before its parent was listed
+                child = FileNode(name, True, parent=node)
+                self._insert(node, child)
+            node = child
+        return node
+
+    def index_for_path(self, path):
+        return self.node_index(self.find_node(path, create=True))
+
+    def filePath(self, index):
+        return self.node_path(self.node(index))
+
+    def is_loaded(self, path):
+        node = self.find_node(path)
+        return node is not None and node.loaded
+
+    def _renumber(self, node, start=0):
+        for row in range(start, len(node.children)):
+            node.children[row].row = row
+
+    def _insert(self, parent, child):
+        keys = [c.sort_key() for c in parent.children]
+        row = bisect.bisect(keys, child.sort_key())
+        self.beginInsertRows(self.node_index(parent), row, row)
+        parent.children.insert(row, child)
+        self._renumber(parent, row)
+        self.endInsertRows()
+
+    def _remove(self, parent, row):
+        self.beginRemoveRows(self.node_index(parent), row, row)
+        del parent.children[row]
+        self._renumber(parent, row)
+        self.endRemoveRows()
+
+    def apply_listing(self, path, entries):
+        node = self.find_node(path, create=True)
+        listed = {name: (is_dir, size, mtime) for name, is_dir, size, mtime in entries}
+
+        for row in range(len(node.children) - 1, -1, -1):
+            child = node.children[row]
+            # A file that became a directory (or vice versa) is re-inserted
+            if child.name not in listed or listed[child.name][0] != child.is_dir:
+                self._remove(node, row)
+
+        existing = {child.name: child for child in node.children}
+        for name, (is_dir, size, mtime) in listed.items():
+            child = existing.get(name)
+            if child is None:
+                self._insert(node, FileNode(name, is_dir, size, mtime, node))
+            elif (child.size, child.mtime) != (size, mtime):
+                child.size, child.mtime = size, mtime
+                self.dataChanged.emit(self.createIndex(child.row, 1, child),
+                                      self.createIndex(child.row, len(self.HEADERS) - 1, child))
+
+        node.loaded = True
+        node.fetching = False
 
 
 class CustomTreeView(QTreeView):
-    def __init__(self, parent=None):
+    def __init__(self, manager, parent=None):
         super().__init__(parent)
+        # The layout reparents the view, so the window is kept separately
+        self.manager = manager
         self.setAcceptDrops(True)
         self.setDragEnabled(True)
         self.setDropIndicatorShown(True)
@@ -62,8 +317,423 @@ class CustomTreeView(QTreeView):
         if event.mimeData().hasUrls():
             event.setDropAction(Qt.CopyAction)
             event.accept()
-            for url in event.mimeData().urls():
-                self.parent().handle_file_drop(url.toLocalFile())
+            self.manager.handle_file_drop([url.toLocalFile() for url in event.mimeData().urls()])
+
+# Syncs the local folder to many boards at once (see FleetSync), with a row
+# per board showing its state, progress and result
+class FleetDialog(QDialog):
+    device_progress = pyqtSignal(str, str, object, object, str)
+    fleet_finished = pyqtSignal(object)
+
+    def __init__(self, parent, local_path, remote_path, ports, delete, device_options, compiler=None):
+        super().__init__(parent)
+        self.setWindowTitle("Fleet Sync")
+        self.resize(720, 400)
+        self.local_path = local_path
+        self.device_options = device_options
+        self.compiler = compiler
+        self.fleet = None
+        self.errors = {}
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel(f"Local folder: {local_path}"))
+
+        options_layout = QHBoxLayout()
+        self.remote_edit = QLineEdit(remote_path)
+        self.jobs_spin = QSpinBox()
+        self.jobs_spin.setRange(1, 64)
+        self.jobs_spin.setValue(8)
+        self.retries_spin = QSpinBox()
+        self.retries_spin.setRange(0, 10)
+        self.retries_spin.setValue(2)
+        self.delete_check = QCheckBox("Delete extra files")
+        self.delete_check.setChecked(delete)
+        options_layout.addWidget(QLabel("Device folder:"))
+        options_layout.addWidget(self.remote_edit)
+        options_layout.addWidget(QLabel("Parallel:"))
+        options_layout.addWidget(self.jobs_spin)
+        options_layout.addWidget(QLabel("Retries:"))
+        options_layout.addWidget(self.retries_spin)
+        options_layout.addWidget(self.delete_check)
+        layout.addLayout(options_layout)
+
+        self.table = QTableWidget(len(ports), 4)
+        self.table.setHorizontalHeaderLabels(['Port', 'Status', 'Progress', 'Result'])
+        self.table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.rows = {}
+        for row, port in enumerate(ports):
+            port_item = QTableWidgetItem(port)
+            port_item.setFlags(Qt.ItemIsUserCheckable | Qt.ItemIsEnabled)
+            port_item.setCheckState(Qt.Checked)
+            self.table.setItem(row, 0, port_item)
+            self.table.setItem(row, 1, QTableWidgetItem(''))
+            self.table.setCellWidget(row, 2, QProgressBar())
+            self.table.setItem(row, 3, QTableWidgetItem(''))
+            self.rows[port] = row
+        layout.addWidget(self.table)
+
+        button_layout = QHBoxLayout()
+        self.start_button = QPushButton("Start")
+        self.retry_button = QPushButton("Retry Failed")
+        self.stop_button = QPushButton("Stop")
+        self.close_button = QPushButton("Close")
+        self.retry_button.setEnabled(False)
+        self.stop_button.setEnabled(False)
+        button_layout.addStretch()
+        button_layout.addWidget(self.start_button)
+        button_layout.addWidget(self.retry_button)
+        button_layout.addWidget(self.stop_button)
+        button_layout.addWidget(self.close_button)
+        layout.addLayout(button_layout)
+
+        self.start_button.clicked.connect(lambda: self.start(self.checked_ports()))
+        self.retry_button.clicked.connect(lambda: self.start(self.failed_ports()))
+        self.stop_button.clicked.connect(self.stop)
+        self.close_button.clicked.connect(self.close)
+        self.device_progress.connect(self.update_row)
+        self.fleet_finished.connect(self.on_finished)
+
+    def checked_ports(self):
+        return [port for port, row in self.rows.items() if self.table.item(row, 0).checkState() == Qt.Checked]
+
+    def failed_ports(self):
+        return [port for port, error in self.errors.items() if error is not None]
+
+    def start(self, ports):
+        if not ports or self.fleet:
+            return
+        fleet = self.fleet = FleetSync(self.local_path, self.remote_edit.text() or '/',
+                                       delete=self.delete_check.isChecked(), max_workers=self.jobs_spin.value(),
+                                       retries=self.retries_spin.value(), device_options=self.device_options,
+                                       compiler=self.compiler)
+        for port in ports:
+            self.update_row(port, 'queued', 0, 0, '')
+        self.start_button.setEnabled(False)
+        self.retry_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
+        self.setWindowTitle(f"Fleet Sync - {len(ports)} board(s)")
+
+        # FleetSync runs its own thread pool; results come back as queued signals
+        threading.Thread(target=lambda: self.fleet_finished.emit(fleet.run(ports, self.device_progress.emit)),
+                         daemon=True).start()
+
+    def update_row(self, port, state, done, total, message):
+        row = self.rows[port]
+        self.table.item(row, 1).setText(state.capitalize())
+        bar = self.table.cellWidget(row, 2)
+        if state == 'syncing':
+            bar.setMaximum(max(total, 1))
+            bar.setValue(done)
+        elif state == 'done':
+            bar.setMaximum(1)
+            bar.setValue(1)
+        elif state != 'failed':
+            bar.setValue(0)
+        self.table.item(row, 3).setText(message)
+
+    def on_finished(self, errors):
+        self.errors.update(errors)
+        self.fleet = None
+        failed = [port for port, error in errors.items() if error is not None]
+        self.start_button.setEnabled(True)
+        self.retry_button.setEnabled(bool(self.failed_ports()))
+        self.stop_button.setEnabled(False)
+        self.setWindowTitle(f"Fleet Sync - {len(errors) - len(failed)}/{len(errors)} board(s) synced")
+
+    def stop(self):
+        if self.fleet:
+            self.fleet.stop()
+
+    def closeEvent(self, event):
+        self.stop()
+        super().closeEvent(event)
+
+
+# Live view of the transport Metrics: link throughput, latency percentiles per
+# operation category and where the time went (host CPU, wire, device)
+class MetricsDock(QDockWidget):
+    COLUMNS = ['Category', 'Count', 'Errors', 'Timeouts', 'Retries', 'p50 ms', 'p99 ms', 'KB/s', 'Payload',
+               'Overhead', 'Host', 'Wire', 'Device']
+
+    def __init__(self, metrics, parent=None):
+        super().__init__("Transfer Metrics", parent)
+        self.setObjectName("metrics_dock")
+        self.metrics = metrics
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        top_layout = QHBoxLayout()
+        self.rate_label = QLabel()
+        export_button = QPushButton("Export...")
+        reset_button = QPushButton("Reset")
+        top_layout.addWidget(self.rate_label)
+        top_layout.addStretch()
+        top_layout.addWidget(export_button)
+        top_layout.addWidget(reset_button)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        layout.addLayout(top_layout)
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+
+        export_button.clicked.connect(self.export)
+        reset_button.clicked.connect(self.reset)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(1000)
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        self.rate_label.setText(f"Link: {self.metrics.transfer_rate() / 1024:.1f} KB/s")
+        summary = self.metrics.summary()
+        format_size = MicroPythonFileManager.format_size
+        self.table.setRowCount(len(summary))
+        for row, (category, stats) in enumerate(summary.items()):
+            seconds = stats['seconds'] or 1
+
+            def share(key):
+                return f"{stats[key] / seconds:.0%}" if self.metrics.profile else ''
+
+            values = [category, stats['count'], stats['errors'], stats['timeouts'], stats['retries'],
+                      stats['p50_ms'], stats['p99_ms'], stats['kb_per_s'], format_size(stats['payload']),
+                      format_size(stats['overhead']), share('host'), share('wire'), share('device')]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(str(value)))
+
+    def reset(self):
+        self.metrics.reset()
+        self.refresh()
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Metrics", "metrics.json", "JSON (*.json);;CSV (*.csv)")
+        if not path:
+            return
+        try:
+            self.metrics.save(path)
+        except OSError as e:
+            QMessageBox.critical(self, "Error", f"Failed to export metrics: {str(e)}")
+
+
+# Searches the board by file name and content. The device walks the tree and
+# sends back only the matches, which are listed as they arrive; double-click
+# one to open its folder.
+class SearchDock(QDockWidget):
+    match_found = pyqtSignal(str, object, object)
+
+    def __init__(self, manager):
+        super().__init__("Search Device", manager)
+        self.setObjectName("search_dock")
+        self.manager = manager
+        self.job = None
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        top_layout = QHBoxLayout()
+        self.folder_edit = QLineEdit("/")
+        self.glob_edit = QLineEdit("*")
+        self.glob_edit.setToolTip("File name pattern; * matches any characters, ? a single one")
+        self.text_edit = QLineEdit()
+        self.text_edit.setPlaceholderText("Text to find in files (optional)")
+        self.search_button = QPushButton("Search")
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setEnabled(False)
+        top_layout.addWidget(QLabel("In:"))
+        top_layout.addWidget(self.folder_edit)
+        top_layout.addWidget(QLabel("Names:"))
+        top_layout.addWidget(self.glob_edit)
+        top_layout.addWidget(QLabel("Containing:"))
+        top_layout.addWidget(self.text_edit, 2)
+        top_layout.addWidget(self.search_button)
+        top_layout.addWidget(self.stop_button)
+        self.table = QTableWidget(0, 3)
+        self.table.setHorizontalHeaderLabels(['Path', 'Offset', 'Line'])
+        self.table.horizontalHeader().setSectionResizeMode(2, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        layout.addLayout(top_layout)
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+
+        for edit in (self.folder_edit, self.glob_edit, self.text_edit):
+            edit.returnPressed.connect(self.search)
+        self.search_button.clicked.connect(self.search)
+        self.stop_button.clicked.connect(self.stop)
+        self.table.cellDoubleClicked.connect(self.open_match)
+        self.match_found.connect(self.add_match)
+
+    def search(self):
+        if self.job or not self.manager.connected:
+            return
+        folder = self.folder_edit.text() or '/'
+        glob = self.glob_edit.text() or '*'
+        pattern = self.text_edit.text().encode()
+        self.table.setRowCount(0)
+
+        def search(job):
+            found = 0
+            for path, offset, line in self.manager.worker.device_fs.search(folder, glob, pattern):
+                found += 1
+                self.match_found.emit(path, offset, line)
+                job.report(found, 0, f"Search: {found} match(es)")
+            return found
+
+        def finished(found):
+            self.searching(None)
+            self.manager.status_bar.showMessage(f"Search: {found} match(es)")
+
+        def failed(e):
+            self.searching(None)
+            QMessageBox.critical(self, "Error", f"Search failed: {str(e)}")
+
+        self.searching(self.manager.run_job('search', search, finished, failed, lambda: self.searching(None)))
+
+    def searching(self, job):
+        self.job = job
+        self.search_button.setEnabled(job is None)
+        self.stop_button.setEnabled(job is not None)
+
+    def stop(self):
+        # The job reports back through its on_cancel, which re-enables Search
+        if self.job:
+            self.job.cancel()
+            self.stop_button.setEnabled(False)
+
+    def add_match(self, path, offset, line):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, QTableWidgetItem(path))
+        self.table.setItem(row, 1, QTableWidgetItem('' if offset is None else str(offset)))
+        self.table.setItem(row, 2, QTableWidgetItem(line.decode('utf-8', errors='replace')))
+
+    def open_match(self, row, column):
+        path = self.table.item(row, 0).text()
+        self.manager.set_mp_path(path.rsplit('/', 1)[0] or '/')
+
+
+# Lists queued, running and finished transfers, with the progress, rate and
+# ETA of the running batch. Transfers are updated on the worker thread, so
+# the rows are refreshed from them by a timer.
+class TransferDock(QDockWidget):
+    COLUMNS = ['Direction', 'Source', 'Destination', 'Size', 'Status']
+
+    def __init__(self, manager):
+        super().__init__("Transfer Queue", manager)
+        self.setObjectName("transfer_dock")
+        self.manager = manager
+        # Transfers of finished batches
+        self.history = []
+        self.rows = []
+        self.shown = []
+
+        widget = QWidget()
+        layout = QVBoxLayout(widget)
+        top_layout = QHBoxLayout()
+        self.summary_label = QLabel()
+        self.stop_button = QPushButton("Stop")
+        clear_button = QPushButton("Clear Finished")
+        top_layout.addWidget(self.summary_label)
+        top_layout.addStretch()
+        top_layout.addWidget(self.stop_button)
+        top_layout.addWidget(clear_button)
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.horizontalHeader().setSectionResizeMode(4, QHeaderView.Stretch)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        layout.addLayout(top_layout)
+        layout.addWidget(self.table)
+        self.setWidget(widget)
+
+        self.stop_button.clicked.connect(manager.stop_transfers)
+        clear_button.clicked.connect(self.clear)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+        self.timer.start(500)
+
+    def finish(self, batch):
+        self.history += batch.transfers
+        self.refresh()
+
+    def clear(self):
+        self.history = []
+        self.refresh()
+
+    @staticmethod
+    def status(transfer):
+        if transfer.state == 'running' and transfer.size:
+            return f"{transfer.done * 100 // transfer.size}%"
+        if transfer.state == 'failed':
+            return f"failed: {transfer.error}"
+        if transfer.state == 'done' and transfer.resumed_from:
+            return "done (resumed)"
+        return transfer.state
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        batches = self.manager.sync_batches + ([self.manager.transfer_batch] if self.manager.transfer_batch else [])
+        queue = self.manager.transfer_queue
+        self.summary_label.setText(self.summary(batches[-1] if batches else None, len(queue)))
+        self.stop_button.setEnabled(self.manager.transfer_batch is not None or len(queue) > 0)
+
+        rows = self.history + [transfer for batch in batches for transfer in batch.transfers] + \
+            list(queue.pending.values())
+        if rows != self.rows:
+            self.rows = rows
+            self.shown = [None] * len(rows)
+            self.table.setRowCount(len(rows))
+        format_size = MicroPythonFileManager.format_size
+        for row, transfer in enumerate(rows):
+            state = (transfer.state, transfer.done, transfer.size)
+            if self.shown[row] == state:
+                continue
+            self.shown[row] = state
+            values = [transfer.direction, transfer.source, transfer.destination,
+                      format_size(transfer.size) if transfer.size else '', self.status(transfer)]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+
+    @staticmethod
+    def summary(batch, queued):
+        if batch is None:
+            return f"{queued} queued" if queued else "Idle"
+        format_size = MicroPythonFileManager.format_size
+        counts = batch.counts()
+        done, total = batch.progress()
+        text = (f"{counts.get('done', 0)} of {len(batch) - counts.get('skipped', 0)} file(s), "
+                f"{format_size(done)} of {format_size(total)}, {batch.rate() / 1024:.1f} KB/s")
+        eta = batch.eta()
+        if eta is not None:
+            text += f", ETA {int(eta) // 60}:{int(eta) % 60:02d}"
+        if queued:
+            text += f", {queued} more queued"
+        return text
+
+
+# Rendered SVG icons shared by every widget, keyed by (name, size, device
+# pixel ratio), so each is rasterized once per process
+_icon_cache = {}
+
+
+def render_icon(name, size):
+    ratio = QApplication.instance().devicePixelRatio()
+    key = (name, size, ratio)
+    icon = _icon_cache.get(key)
+    if icon is None:
+        renderer = QSvgRenderer(QByteArray(MicroPythonFileManager.get_icon_svg(name).encode('utf-8')))
+        pixmap = QPixmap(round(size * ratio), round(size * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        renderer.render(painter, QRectF(0, 0, size, size))
+        painter.end()
+        icon = _icon_cache[key] = QIcon(pixmap)
+    return icon
+
 
 class NavigationWidget(QWidget):
     def __init__(self, parent=None):
@@ -87,19 +757,16 @@ class NavigationWidget(QWidget):
         self.set_button_icon(self.browse_button, 'icon_window')
 
     def set_button_icon(self, button, icon_name):
-        svg_bytes = QByteArray(MicroPythonFileManager.get_icon_svg(icon_name).encode('utf-8'))
-        renderer = QSvgRenderer(svg_bytes)
-        pixmap = QPixmap(24, 24)
-        pixmap.fill(Qt.transparent)
-        painter = QPainter(pixmap)
-        renderer.render(painter)
-        painter.end()
-        button.setIcon(QIcon(pixmap))
+        button.setIcon(render_icon(icon_name, 24))
         button.setIconSize(QSize(24, 24))
 
 class MicroPythonFileManager(QMainWindow):
-    def __init__(self):
+    def __init__(self, started=None):
         super().__init__()
+        # perf_counter() when startup began; the time to the first paint is
+        # recorded as a 'startup' metric
+        self.started = time.perf_counter() if started is None else started
+        self.painted = False
         self.setWindowTitle("MicroPython File Manager")
         self.setGeometry(100, 100, 1000, 600)
 
@@ -108,9 +775,39 @@ class MicroPythonFileManager(QMainWindow):
         self.mp_history = ['/']
         self.mp_current = 0
 
-        self.serial = None
+        self.connected = False
+        self.pending_jobs = 0
+        self.micropython_ports = []
+        self.mpy_compilers = {}
+        # LocalIndex per synced local folder
+        self.local_indexes = {}
+        # QSettings group holding the connected board's tuned chunk size
+        self.tuning_key = None
+        self.port_scanner = PortScanner()
+        self.listing_cache = ListingCache()
+        self.metrics = Metrics(profile=True)
+        # Uploads and downloads wait here; one TransferBatch runs at a time
+        self.transfer_queue = TransferQueue()
+        self.transfer_batch = None
+        self.transfer_job = None
+        # Batches of the syncs in progress, shown in the queue as well
+        self.sync_batches = []
+        self.worker = TransportWorker(self)
+        self.worker.job_progress.connect(self.on_job_progress)
+        self.worker.job_finished.connect(self.on_job_finished)
+        self.worker.job_failed.connect(self.on_job_failed)
+        self.worker.start()
+
         self.status_bar = self.statusBar()
         self.board_info = QLabel()
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.hide()
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.hide()
+        self.cancel_button.clicked.connect(self.cancel_jobs)
+        self.status_bar.addPermanentWidget(self.progress_bar)
+        self.status_bar.addPermanentWidget(self.cancel_button)
         self.status_bar.addPermanentWidget(self.board_info)
 
         self.set_window_icon()
@@ -130,6 +827,25 @@ class MicroPythonFileManager(QMainWindow):
         top_layout.addWidget(self.connect_button)
         top_layout.addStretch()
 
+        self.metrics_dock = MetricsDock(self.metrics, self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.metrics_dock)
+        self.metrics_dock.hide()
+        self.metrics_button = QToolButton()
+        self.metrics_button.setDefaultAction(self.metrics_dock.toggleViewAction())
+        top_layout.addWidget(self.metrics_button)
+        self.search_dock = SearchDock(self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.search_dock)
+        self.search_dock.hide()
+        self.search_dock_button = QToolButton()
+        self.search_dock_button.setDefaultAction(self.search_dock.toggleViewAction())
+        top_layout.addWidget(self.search_dock_button)
+        self.transfer_dock = TransferDock(self)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.transfer_dock)
+        self.transfer_dock.hide()
+        self.transfer_dock_button = QToolButton()
+        self.transfer_dock_button.setDefaultAction(self.transfer_dock.toggleViewAction())
+        top_layout.addWidget(self.transfer_dock_button)
+
         splitter = QSplitter(Qt.Horizontal)
 
         # Local file system
@@ -138,7 +854,6 @@ class MicroPythonFileManager(QMainWindow):
         self.local_nav = NavigationWidget()
         self.local_tree = CustomTreeView(self)
         self.local_model = QFileSystemModel()
-        self.local_model.setRootPath(QDir.rootPath())
         self.local_tree.setModel(self.local_model)
         local_layout.addWidget(self.local_nav)
         local_layout.addWidget(self.local_tree)
@@ -162,12 +877,20 @@ class MicroPythonFileManager(QMainWindow):
         self.sync_to_button = QPushButton("Sync to Board")
         self.sync_from_button = QPushButton("Sync from Board")
         self.delete_button = QPushButton("Delete")
+        self.sync_delete_check = QCheckBox("Delete extra files on sync")
+        self.precompile_check = QCheckBox("Precompile .py to .mpy")
+        self.precompile_check.setChecked(
+            QSettings("YourCompany", "MicroPythonFileManager").value("precompile_mpy", False, type=bool))
+        self.fleet_button = QPushButton("Fleet Sync")
         bottom_layout.addWidget(self.refresh_button)
         bottom_layout.addWidget(self.upload_button)
         bottom_layout.addWidget(self.download_button)
         bottom_layout.addWidget(self.sync_to_button)
         bottom_layout.addWidget(self.sync_from_button)
         bottom_layout.addWidget(self.delete_button)
+        bottom_layout.addWidget(self.sync_delete_check)
+        bottom_layout.addWidget(self.precompile_check)
+        bottom_layout.addWidget(self.fleet_button)
 
         self.set_button_icons()
 
@@ -183,6 +906,9 @@ class MicroPythonFileManager(QMainWindow):
         self.sync_to_button.clicked.connect(self.sync_to_board)
         self.sync_from_button.clicked.connect(self.sync_from_board)
         self.delete_button.clicked.connect(self.delete_file)
+        self.fleet_button.clicked.connect(self.fleet_sync)
+        self.precompile_check.toggled.connect(
+            lambda checked: QSettings("YourCompany", "MicroPythonFileManager").setValue("precompile_mpy", checked))
 
         self.local_nav.path_edit.returnPressed.connect(self.navigate_local)
         self.local_nav.browse_button.clicked.connect(self.browse_local_folder)
@@ -198,8 +924,8 @@ class MicroPythonFileManager(QMainWindow):
         self.local_tree.doubleClicked.connect(self.on_local_double_click)
         self.mp_tree.doubleClicked.connect(self.on_mp_double_click)
 
+        # Ports are scanned once the window has been painted
         self.load_last_directory()
-        self.refresh_ports()
 
         self.setStyleSheet("""
         QWidget {
@@ -209,7 +935,11 @@ class MicroPythonFileManager(QMainWindow):
         """)
 
         self.micro_model = MicroPythonFileModel(self)
+        self.micro_model.fetch_requested.connect(self.fetch_mp_dir)
         self.mp_tree.setModel(self.micro_model)
+        self.mp_tree.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Double-click navigates into a directory; the arrow expands it in place
+        self.mp_tree.setExpandsOnDoubleClick(False)
 
     def local_go_back(self):
         if self.local_current > 0:
@@ -229,6 +959,8 @@ class MicroPythonFileManager(QMainWindow):
         self.set_local_path(parent_path)
 
     def set_local_path(self, path):
+        # Only the shown directory is watched
+        self.local_model.setRootPath(path)
         index = self.local_model.index(path)
         if index.isValid():
             self.local_tree.setRootIndex(index)
@@ -272,45 +1004,54 @@ class MicroPythonFileManager(QMainWindow):
         if path == '':
             path = '/'
 
-        # 尝试在 MicroPython 设备上切换目录
-        try:
-            # 切换目录
-            self.send_command(f"import os")
-            result = self.send_command(f"os.chdir('{path}')")
-            
-            # 验证当前目录
-            current_path = self.send_command("print(os.getcwd())")
-            if current_path.strip() != path:
-                raise Exception(f"Failed to change directory to {path}")
-            
+        # 在后台线程中验证目录并获取文件列表
+        def change_dir(job):
+            mode = self.worker.device_fs.stat_mode(path)
+            if mode is None or not mode & 0x4000:
+                raise MicroPythonError(f"Failed to change directory to {path}")
+            return self.fetch_listing(path)
+
+        def show(result):
             # 更新 UI 中的路径显示
             self.mp_nav.path_edit.setText(path)
-            
+
             # 更新历史记录
             if self.mp_current == -1 or path != self.mp_history[self.mp_current]:
                 self.mp_current += 1
                 self.mp_history = self.mp_history[:self.mp_current]
                 self.mp_history.append(path)
-            
+
             # 更新导航按钮状态
             self.update_mp_nav_buttons()
-            
-            # 刷新文件列表
-            self.get_file_list()
-            
-            # 更新可用空间显示
-            self.update_free_space()
-            
-        except Exception as e:
+
+            # 刷新文件列表和可用空间显示
+            self.show_file_list(path, result)
+
+        def done(result):
+            self.cache_listing(path, result)
+            show(result)
+
+        # 有缓存时立即显示，过期的缓存在后台重新验证
+        cached = self.listing_cache.get(path)
+        if cached:
+            entries, fresh = cached
+            show((entries, self.listing_cache.free_space))
+            if not fresh:
+                self.run_job('list', lambda job: self.fetch_listing(path), lambda result: self.listing_loaded(path, result))
+            return
+
+        def failed(e):
             # 如果出现错误，显示错误消息
             QMessageBox.critical(self, "Error", f"Failed to set path: {str(e)}")
-            
+
             # 如果切换目录失败，回退到上一个有效路径
             if self.mp_current > 0:
                 self.mp_current -= 1
                 last_valid_path = self.mp_history[self.mp_current]
                 self.mp_nav.path_edit.setText(last_valid_path)
 
+        self.run_job('chdir', change_dir, done, failed)
+
     def update_mp_nav_buttons(self):
         # 更新后退按钮状态
         self.mp_nav.back_button.setEnabled(self.mp_current > 0)
@@ -324,17 +1065,64 @@ class MicroPythonFileManager(QMainWindow):
 
     def closeEvent(self, event):
         self.disconnect()
+        self.worker.stop()
         self.save_last_directory()
         event.accept()
 
+    def run_job(self, kind, fn, on_done=None, on_error=None, on_cancel=None):
+        job = Job(kind, fn, on_done, on_error, on_cancel)
+        self.pending_jobs += 1
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.show()
+        self.cancel_button.show()
+        return self.worker.submit(job)
+
+    def job_ended(self):
+        self.pending_jobs -= 1
+        if self.pending_jobs <= 0:
+            self.pending_jobs = 0
+            self.progress_bar.hide()
+            self.cancel_button.hide()
+
+    def on_job_progress(self, job, done, total, message):
+        if total > 0:
+            self.progress_bar.setRange(0, total)
+            self.progress_bar.setValue(done)
+        if message:
+            self.status_bar.showMessage(message)
+
+    def on_job_finished(self, job, result):
+        self.job_ended()
+        if job.on_done:
+            job.on_done(result)
+
+    def on_job_failed(self, job, error):
+        self.job_ended()
+        if isinstance(error, ReplCancelled):
+            self.status_bar.showMessage(f"{job.kind} cancelled")
+            if job.on_cancel:
+                job.on_cancel()
+        elif job.on_error:
+            job.on_error(error)
+        elif isinstance(error, ReplTimeout):
+            QMessageBox.warning(self, "Error", "Timeout Error!")
+        else:
+            QMessageBox.critical(self, "Error", f"{job.kind} failed: {str(error)}")
+
+    def cancel_jobs(self):
+        self.worker.cancel_all()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            startup = time.perf_counter() - self.started
+            self.metrics.record('startup', startup, 0, 0)
+            self.status_bar.showMessage(f"Started in {startup * 1000:.0f} ms")
+            QTimer.singleShot(0, self.refresh_ports)
+
     def set_window_icon(self):
-        svg = QSvgRenderer(QByteArray(self.get_icon_svg('icon_window').encode('utf-8')))
-        pixmap = QPixmap(32, 32)
-        pixmap.fill(Qt.transparent)
-        painter = QPainter(pixmap)
-        svg.render(painter)
-        painter.end()
-        self.setWindowIcon(QIcon(pixmap))
+        self.setWindowIcon(render_icon('icon_window', 32))
 
     def set_button_icons(self):
         icons = self.get_button_icons()
@@ -351,161 +1139,220 @@ class MicroPythonFileManager(QMainWindow):
             button.setIconSize(icon_size)
 
     def get_button_icons(self):
-        icons = {}
-        for name in ['refresh_ports', 'refresh', 'disconnect', 'connect', 'upload', 'download', 'sync_to', 'sync_from', 'delete']:
-            svg = QSvgRenderer(QByteArray(self.get_icon_svg(f'icon_{name}').encode('utf-8')))
-            pixmap = QPixmap(32, 32)
-            pixmap.fill(Qt.transparent)
-            painter = QPainter(pixmap)
-            svg.render(painter)
-            painter.end()
-            icons[name] = QIcon(pixmap)
-        return icons
+        return {name: render_icon(f'icon_{name}', 32)
+                for name in ['refresh_ports', 'refresh', 'disconnect', 'connect', 'upload', 'download', 'sync_to',
+                             'sync_from', 'delete']}
 
     def refresh_ports(self):
-        self.port_combo.clear()
-        ports = serial.tools.list_ports.comports()
-        micropython_ports = []
-        
-        for port in ports:
-            try:
-                ser = serial.Serial(port.device, 115200, timeout=1)
-                ser.write(b'\x04')  # Soft reset
-                time.sleep(0.5)
-                response = ser.read_all().decode('utf-8', errors='ignore')
-                
-                if 'MicroPython' in response:
-                    micropython_ports.append(port)
-                    self.port_combo.addItem(f"{port.device} - MicroPython", port.device)
+        # The connected port is held open by the worker and must not be probed
+        skip = (self.port_combo.currentData(),) if self.connected else ()
+
+        def done(results):
+            self.port_combo.clear()
+            micropython_ports = self.micropython_ports = []
+            for device, is_micropython in results:
+                if is_micropython:
+                    micropython_ports.append(device)
+                    self.port_combo.addItem(f"{device} - MicroPython", device)
                 else:
-                    self.port_combo.addItem(f"{port.device}", port.device)
-                
-                ser.close()
-            except:
-                self.port_combo.addItem(f"{port.device}", port.device)
-        
-        if micropython_ports:
-            self.port_combo.setCurrentIndex(self.port_combo.findData(micropython_ports[0].device))
-        
-        self.status_bar.showMessage(f"Found {len(micropython_ports)} MicroPython device(s)")
+                    self.port_combo.addItem(f"{device}", device)
+
+            if micropython_ports:
+                self.port_combo.setCurrentIndex(self.port_combo.findData(micropython_ports[0]))
+
+            self.status_bar.showMessage(f"Found {len(micropython_ports)} MicroPython device(s)")
+
+        self.run_job('refresh ports', lambda job: self.port_scanner.scan(skip), done)
 
     def toggle_connection(self):
-        if self.serial is None or not self.serial.is_open:
+        if not self.connected:
             self.connect()
         else:
             self.disconnect()
 
+    def connection_options(self):
+        settings = QSettings("YourCompany", "MicroPythonFileManager")
+        # Unset: keep as many bytes in flight as the firmware's raw-paste window
+        window = settings.value("pipeline_window")
+        return {
+            'chunk_size': int(settings.value("upload_chunk_size", 2048)),
+            'encoding': settings.value("upload_encoding", "base64"),
+            'compress': settings.value("transfer_compression", True, type=bool),
+            'window': int(window) if window is not None else None,
+            'metrics': self.metrics,
+            'adaptive': settings.value("adaptive_chunks", True, type=bool),
+        }
+
+    def mpy_compiler(self):
+        # None unless precompiling is on. One compiler per command, so its
+        # version is only queried once.
+        if not self.precompile_check.isChecked():
+            return None
+        command = QSettings("YourCompany", "MicroPythonFileManager").value("mpy_cross_command", "mpy-cross")
+        if command not in self.mpy_compilers:
+            self.mpy_compilers[command] = MpyCompiler(command)
+        return self.mpy_compilers[command]
+
     def connect(self):
         port = self.port_combo.currentData()
-        try:
-            self.serial = serial.Serial(port, 115200, timeout=1)
+        options = self.connection_options()
+
+        def open_port(job):
+            self.worker.open(port, **options)
+            return self.worker.device_fs.board_info()
+
+        def done(board_info):
+            self.connected = True
+            self.listing_cache.clear()
             self.connect_button.setText("Disconnect")
             self.connect_button.setIcon(self.get_button_icons()['disconnect'])
             self.status_bar.showMessage(f"Connected to {port}")
-            self.get_board_info()
+            self.restore_tuning(port)
+            self.board_info.setText(board_info)
             self.get_file_list()
             self.update_file_ops_buttons(True)
-        except serial.SerialException as e:
+
+        def failed(e):
             QMessageBox.critical(self, "Connection Error", f"Failed to connect: {str(e)}")
             self.status_bar.showMessage(f"Failed to connect: {str(e)}")
 
+        self.run_job('connect', open_port, done, failed)
+
+    def restore_tuning(self, port):
+        # Chunk sizes are learned per board (by unique id, else by port) and
+        # picked up again on the next connection
+        device_fs = self.worker.device_fs
+        if not device_fs or not device_fs.tuner:
+            return
+        tuner = device_fs.tuner
+        board = device_fs.board_id or port
+        self.tuning_key = "chunk_tuning/" + "".join(c if c.isalnum() else '_' for c in board)
+        settings = QSettings("YourCompany", "MicroPythonFileManager")
+        if settings.contains(self.tuning_key + "/size"):
+            tuner.restore({'size': int(settings.value(self.tuning_key + "/size")),
+                           'maximum': int(settings.value(self.tuning_key + "/maximum", tuner.maximum))})
+        self.status_bar.showMessage(f"Connected to {port} ({tuner.size} byte chunks, "
+                                    f"{tuner.rtt * 1000:.0f} ms round trip)")
+
+    def save_tuning(self):
+        device_fs = self.worker.device_fs
+        if not self.tuning_key or not device_fs or not device_fs.tuner:
+            return
+        settings = QSettings("YourCompany", "MicroPythonFileManager")
+        for name, value in device_fs.tuner.state().items():
+            settings.setValue(f"{self.tuning_key}/{name}", value)
+        self.tuning_key = None
+
     def disconnect(self):
-        if self.serial:
-            self.serial.close()
-        self.serial = None
+        self.save_tuning()
+        self.transfer_queue.clear()
+        self.worker.cancel_all()
+        self.run_job('disconnect', lambda job: self.worker.close())
+        self.connected = False
+        self.listing_cache.clear()
         self.connect_button.setText("Connect")
         self.connect_button.setIcon(self.get_button_icons()['connect'])
         self.status_bar.showMessage("Disconnected")
         self.board_info.setText("")
         self.micro_model.clear()
-        self.micro_model.setHorizontalHeaderLabels(['Name', 'Size', 'Type', 'Last Modified'])
-        self.micro_model.set_root_path('/')
         self.mp_tree.setRootIndex(QModelIndex())
         self.update_file_ops_buttons(False)
-        self.update_free_space()
 
+    def get_file_list(self, force=False):
+        if not self.connected:
+            return
 
-    def get_board_info(self):
-        if not self.serial:
+        path = self.get_current_mp_path()
+        if not force:
+            cached = self.listing_cache.get(path)
+            if cached:
+                entries, fresh = cached
+                self.show_file_list(path, (entries, self.listing_cache.free_space))
+                if fresh:
+                    return
+
+        def failed(e):
+            QMessageBox.warning(self, "Error", f"Failed to list {path}: {str(e)}")
+
+        self.run_job('list', lambda job: self.fetch_listing(path), lambda result: self.listing_loaded(path, result), failed)
+
+    def fetch_listing(self, path):
+        # Runs on the worker thread
+        return self.worker.device_fs.listdir(path), self.worker.device_fs.free_space()
+
+    def cache_listing(self, path, result):
+        entries, free_space = result
+        self.listing_cache.put(path, entries)
+        self.listing_cache.free_space = free_space
+
+    def listing_loaded(self, path, result):
+        if not self.connected:
             return
-        self.serial.write(b'\x04')  # Soft reset
-        time.sleep(0.5)
-        response = self.serial.read_all().decode('utf-8', errors='ignore').split('\n')[0]
-        self.board_info.setText(response)
+        self.cache_listing(path, result)
+        # The user may have navigated elsewhere while the listing was loading
+        if self.listing_cache.key(path) == self.listing_cache.key(self.get_current_mp_path()):
+            self.show_file_list(path, result)
+        else:
+            self.micro_model.apply_listing(path, result[0])
 
-    def get_file_list(self):
-        if not self.serial:
+    def show_file_list(self, path, result):
+        entries, free_space = result
+        self.micro_model.apply_listing(path, entries)
+        self.mp_tree.setRootIndex(self.micro_model.index_for_path(path))
+        if free_space is None:
+            self.update_free_space()
+        else:
+            self.show_free_space(free_space)
+
+    def fetch_mp_dir(self, path):
+        # Requested by the model the first time a directory is expanded
+        if not self.connected:
+            self.micro_model.fetch_failed(path)
             return
-        
-        self.send_command("import os")
-        response = self.send_command("print(os.listdir())")
-        
-        try:
-            files = ast.literal_eval(response)
-        except (SyntaxError, ValueError) as e:
-            QMessageBox.warning(self, "Parse Error", f"Failed to parse file list: {str(e)}")
+
+        cached = self.listing_cache.get(path)
+        if cached:
+            entries, fresh = cached
+            self.micro_model.apply_listing(path, entries)
+            if fresh:
+                return
+
+        def failed(e):
+            self.micro_model.fetch_failed(path)
+            self.status_bar.showMessage(f"Failed to list {path}: {str(e)}")
+
+        self.run_job('list', lambda job: self.worker.device_fs.listdir(path),
+                     lambda entries: self.mp_dir_loaded(path, entries), failed)
+
+    def mp_dir_loaded(self, path, entries):
+        if not self.connected:
             return
-        
-        is_dir_list = []
-        size_list = []
-        mtime_list = []
-        for file in files:
-            stat_result = self.send_command(f"print(os.stat('{file}'))")
-            try:
-                stat = ast.literal_eval(stat_result)
-                is_dir = stat[0] & 0x4000 != 0  # Check if it's a directory
-                size = stat[6]  # st_size
-                mtime = stat[8]  # st_mtime
-            except (SyntaxError, ValueError, IndexError) as e:
-                print(f"Error parsing stat for {file}: {e}")
-                is_dir = False
-                size = 0
-                mtime = 0
-            
-            is_dir_list.append(is_dir)
-            size_list.append(size)
-            mtime_list.append(mtime)
-        
-        self.micro_model.refresh(files, is_dir_list, size_list, mtime_list)
-        self.micro_model.set_root_path('/')
-        self.mp_tree.setRootIndex(QModelIndex())
-        
-        self.update_free_space()
+        self.listing_cache.put(path, entries)
+        self.micro_model.apply_listing(path, entries)
+
+    def reload_mp_dirs(self, paths):
+        # Re-list changed directories that are expanded in the tree; the
+        # current directory is refreshed as well (with free space)
+        current = self.listing_cache.key(self.get_current_mp_path())
+        for path in {self.listing_cache.key(path) for path in paths}:
+            if path != current and self.micro_model.is_loaded(path):
+                self.run_job('list', lambda job, path=path: self.worker.device_fs.listdir(path),
+                             lambda entries, path=path: self.mp_dir_loaded(path, entries),
+                             lambda e: None)  # Removed meanwhile; the parent listing drops it
+        self.refresh_files()
 
     def update_free_space(self):
-        if not self.serial:
+        if not self.connected:
             return
-        
-        response = self.send_command("import os; print(os.statvfs('/'))")
-        try:
-            stat = ast.literal_eval(response)
-            free_space = stat[0] * stat[3]  # f_bsize * f_bfree
-            self.status_bar.showMessage(f"Free space: {free_space / 1024:.2f} KB")
-        except (SyntaxError, ValueError) as e:
-            self.status_bar.showMessage("Failed to get free space")
-
-    def send_command(self, command):
-        if not self.serial:
-            raise Exception("Serial connection is not established")
-        
-        self.serial.write(f"{command}\r\n".encode())
-        response = b""
-        timeout = time.time() + 5  # 5 seconds timeout
-        
-        while True:
-            if self.serial.in_waiting:
-                line = self.serial.readline()
-                if b">>>" in line:
-                    break
-                response += line
-            
-            if time.time() > timeout:
-                QMessageBox.warning(self, "Error", "Timeout Error!")
-                return None
-                #raise Exception("Command timeout")
-        
-        response = response.decode().strip()
-        return response.replace(command, "").replace(">>>", "").strip()
+        self.run_job('free space', lambda job: self.worker.device_fs.free_space(), self.free_space_loaded,
+                     lambda e: self.status_bar.showMessage("Failed to get free space"))
+
+    def free_space_loaded(self, free_space):
+        self.listing_cache.free_space = free_space
+        self.show_free_space(free_space)
+
+    def show_free_space(self, free_space):
+        self.status_bar.showMessage(f"Free space: {free_space / 1024:.2f} KB")
 
     def update_file_ops_buttons(self, enabled):
         self.upload_button.setEnabled(enabled)
@@ -515,82 +1362,173 @@ class MicroPythonFileManager(QMainWindow):
         self.sync_from_button.setEnabled(enabled)
 
     def upload_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select File to Upload")
-        if file_path:
-            self.upload_single_file(file_path)
-
-    def upload_single_file(self, file_path):
-        if not self.serial:
-            QMessageBox.warning(self, "Error", "Not connected to a device")
-            return
-
-        file_name = os.path.basename(file_path)
-        destination = self.get_current_mp_path()
-        full_destination = os.path.join(destination, file_name).replace('\\', '/')
-
-        # Check if file already exists
-        if self.send_command(f"import os; print(os.path.exists('{full_destination}'))") == "True":
-            reply = QMessageBox.question(self, 'File exists', 
-                                         f"File {file_name} already exists. Do you want to overwrite?",
-                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
-            if reply == QMessageBox.No:
-                return
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files to Upload")
+        if file_paths:
+            self.upload_files(file_paths)
 
-        with open(file_path, 'rb') as file:
-            content = file.read()
-
-        self.send_command(f"f = open('{full_destination}', 'wb')")
-        chunk_size = 1024
-        for i in range(0, len(content), chunk_size):
-            chunk = content[i:i+chunk_size]
-            self.send_command(f"f.write({chunk})")
-        self.send_command("f.close()")
-
-        QMessageBox.information(self, "Upload Complete", f"File {file_name} uploaded successfully")
-        self.refresh_files()
+    def upload_files(self, file_paths):
+        # Files and folders go into the current device directory
+        destination = self.get_current_mp_path().rstrip('/')
+        self.queue_transfers('upload', [(path, f"{destination}/{os.path.basename(path.rstrip('/'))}")
+                                        for path in file_paths])
 
     def download_file(self):
-        indexes = self.mp_tree.selectedIndexes()
-        if not indexes:
+        paths = self.selected_mp_paths()
+        if not paths:
             QMessageBox.warning(self, "Error", "No file selected")
             return
 
-        file_path = self.micro_model.filePath(indexes[0])
-        file_name = os.path.basename(file_path)
-        source = self.get_current_mp_path()
-        full_source = os.path.join(source, file_name).replace('\\', '/')
+        node = self.micro_model.find_node(paths[0])
+        if len(paths) == 1 and node is not None and not node.is_dir:
+            save_path, _ = QFileDialog.getSaveFileName(self, "Save File", os.path.basename(paths[0]))
+            if save_path:
+                # The save dialog already asked about replacing the file
+                self.queue_transfers('download', [(paths[0], save_path)], overwrite=True)
+            return
 
-        save_path, _ = QFileDialog.getSaveFileName(self, "Save File", file_name)
-        if save_path:
-            # Get file size
-            size = int(self.send_command(f"import os; print(os.stat('{full_source}')[6])"))
-            
-            with open(save_path, 'wb') as file:
-                # Read file in chunks
-                chunk_size = 1024
-                for i in range(0, size, chunk_size):
-                    chunk = self.send_command(f"print(open('{full_source}', 'rb').read({chunk_size}))")
-                    chunk = ast.literal_eval(chunk)  # Convert string representation of bytes to actual bytes
-                    file.write(chunk)
-            
-            QMessageBox.information(self, "Download Complete", f"File {file_name} downloaded successfully")
+        folder = QFileDialog.getExistingDirectory(self, "Download To")
+        if folder:
+            self.queue_transfers('download', [(path, os.path.join(folder, os.path.basename(path) or 'board'))
+                                              for path in paths])
+
+    def selected_mp_paths(self):
+        # One index per column: keep each selected row once, and skip entries
+        # inside a selected directory since they go with it
+        paths = sorted({self.micro_model.filePath(index) for index in self.mp_tree.selectedIndexes()})
+        return [path for path in paths
+                if not any(path.startswith(other.rstrip('/') + '/') for other in paths if other != path)]
+
+    def queue_transfers(self, direction, items, overwrite=False):
+        # items are (source, destination) pairs; they run with whatever else
+        # is queued once the current batch is done
+        if not self.connected:
+            QMessageBox.warning(self, "Error", "Not connected to a device")
+            return
+        for source, destination in items:
+            self.transfer_queue.add(direction, source, destination, overwrite=overwrite)
+        self.start_transfers()
+        self.transfer_dock.refresh()
+
+    def start_transfers(self):
+        if self.transfer_batch is not None or not self.transfer_queue or not self.connected:
+            return
+        batch = self.transfer_batch = self.transfer_queue.take()
+        compiler = self.mpy_compiler()
+        if len(batch) > 1:
+            self.transfer_dock.show()
+
+        def prefetch(job):
+            job.report(0, 0, f"Checking {len(batch)} file(s)")
+            batch.prefetch(self.worker.device_fs, compiler)
+
+        def checked(result):
+            existing = batch.existing()
+            if existing:
+                if len(existing) == 1:
+                    text = f"File {os.path.basename(existing[0].destination)} already exists. Do you want to overwrite?"
+                else:
+                    text = f"{len(existing)} files already exist. Do you want to overwrite them?"
+                box = QMessageBox(QMessageBox.Question, 'File exists', text,
+                                  QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel, self)
+                box.setInformativeText("No skips the existing files.")
+                if len(existing) > 1:
+                    box.setDetailedText("\n".join(transfer.destination for transfer in existing))
+                reply = box.exec_()
+                if reply == QMessageBox.Cancel:
+                    stopped()
+                    return
+                if reply == QMessageBox.No:
+                    batch.skip_existing()
+            self.transfer_job = self.run_job('transfer', run, finished, failed, stopped)
+
+        def run(job):
+            def progress(transfer):
+                verb = "Uploading" if transfer.direction == 'upload' else "Downloading"
+                job.report(*batch.progress(), f"{verb} {os.path.basename(transfer.source)}")
+
+            batch.run(self.worker.device_fs, progress, compiler)
+
+        def ended():
+            batch.cancel()
+            self.transfer_batch = None
+            self.transfer_job = None
+            self.transfer_dock.finish(batch)
+            # Refresh the view once for the whole batch
+            dirs = batch.affected_remote_dirs()
+            if dirs and self.connected:
+                self.listing_cache.invalidate(*dirs)
+                self.reload_mp_dirs(dirs)
+
+        def finished(result=None):
+            ended()
+            counts = batch.counts()
+            done = [transfer for transfer in batch.transfers if transfer.state == 'done']
+            transferred = (sum(transfer.transferred[0] for transfer in done),
+                           sum(transfer.transferred[1] for transfer in done))
+            summary = self.transfer_summary(transferred, batch.finished - batch.started,
+                                            sum(transfer.resumed_from for transfer in done))
+            message = f"Transferred {len(done)} file(s): {summary}"
+            if counts.get('skipped'):
+                message += f", skipped {counts['skipped']}"
+            self.status_bar.showMessage(message)
+            failures = [transfer for transfer in batch.transfers if transfer.state == 'failed']
+            if failures:
+                box = QMessageBox(QMessageBox.Warning, "Error", f"{len(failures)} transfer(s) failed", QMessageBox.Ok, self)
+                box.setDetailedText("\n".join(f"{transfer.source}: {transfer.error}" for transfer in failures))
+                box.exec_()
+            self.start_transfers()
+
+        def failed(e):
+            ended()
+            QMessageBox.critical(self, "Error", f"Transfer failed: {str(e)}")
+            self.start_transfers()
+
+        def stopped():
+            ended()
+            self.start_transfers()
+
+        self.transfer_job = self.run_job('transfer', prefetch, checked, failed, stopped)
+
+    def stop_transfers(self):
+        self.transfer_queue.clear()
+        if self.transfer_job:
+            self.transfer_job.cancel()
+        self.transfer_dock.refresh()
 
     def delete_file(self):
-        indexes = self.mp_tree.selectedIndexes()
-        if not indexes:
+        paths = self.selected_mp_paths()
+        if not paths:
             QMessageBox.warning(self, "Error", "No file selected")
             return
 
-        file_path = self.micro_model.filePath(indexes[0])
-        file_name = os.path.basename(file_path)
-        full_path = os.path.join(self.get_current_mp_path(), file_name).replace('\\', '/')
+        if '/' in paths:
+            QMessageBox.warning(self, "Error", "The root directory can't be deleted")
+            return
+        names = os.path.basename(paths[0]) if len(paths) == 1 else f"{len(paths)} items"
+        parents = {path.rsplit('/', 1)[0] or '/' for path in paths}
 
-        reply = QMessageBox.question(self, 'Confirm Deletion', 
-                                     f"Are you sure you want to delete {file_name}?",
+        reply = QMessageBox.question(self, 'Confirm Deletion',
+                                     f"Are you sure you want to delete {names}? "
+                                     "Directories are deleted with everything in them.",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.send_command(f"import os; os.remove('{full_path}')")
-            self.refresh_files()
+            def delete(job):
+                return self.worker.device_fs.remove_tree(
+                    paths, lambda removed, total: job.report(removed, total, f"Deleted {removed} item(s)"))
+
+            def finished(removed=None):
+                for path in paths:
+                    self.listing_cache.invalidate_tree(path)
+                self.listing_cache.invalidate(*parents)
+                self.reload_mp_dirs(parents)
+                if removed is not None:
+                    self.status_bar.showMessage(f"Deleted {removed} item(s)")
+
+            def failed(e):
+                QMessageBox.critical(self, "Error", f"Failed to delete {names}: {str(e)}")
+                finished()
+
+            self.run_job('delete', delete, finished, failed)
 
     def sync_to_board(self):
         local_path = self.local_model.filePath(self.local_tree.rootIndex())
@@ -602,93 +1540,125 @@ class MicroPythonFileManager(QMainWindow):
         mp_path = self.get_current_mp_path()
         self.sync_folders(local_path, mp_path, to_board=False)
 
+    def fleet_sync(self):
+        # The connected board's port is held open by the worker
+        connected_port = self.port_combo.currentData() if self.connected else None
+        ports = [port for port in self.micropython_ports if port != connected_port]
+        if not ports:
+            QMessageBox.information(self, "Fleet Sync", "No other MicroPython boards found. Refresh the ports "
+                                                        "with the boards plugged in (disconnect to include this one).")
+            return
+        local_path = self.local_model.filePath(self.local_tree.rootIndex())
+        dialog = FleetDialog(self, local_path, self.get_current_mp_path(), ports,
+                             self.sync_delete_check.isChecked(), self.connection_options(), self.mpy_compiler())
+        dialog.exec_()
+
     def sync_folders(self, local_path, mp_path, to_board):
-        if to_board:
-            for root, dirs, files in os.walk(local_path):
-                for file in files:
-                    local_file = os.path.join(root, file)
-                    relative_path = os.path.relpath(local_file, local_path)
-                    #mp_file = os.path.join(mp_path, relative_path).replace('\\', '/')
-                    self.upload_single_file(local_file)
-        else:
-            # Recursively list files on MicroPython board
-            def list_files(dir_path):
-                command = f"import os; print('\\n'.join([f for f in os.listdir('{dir_path}') if os.stat('{dir_path}/'+f)[0] & 0x8000]))"
-                files = self.send_command(command).split('\n')
-                
-                for file in files:
-                    if file:  # Ignore empty strings
-                        full_path = os.path.join(dir_path, file).replace('\\', '/')
-                        yield full_path
-
-                command = f"import os; print('\\n'.join([d for d in os.listdir('{dir_path}') if not os.stat('{dir_path}/'+d)[0] & 0x8000]))"
-                dirs = self.send_command(command).split('\n')
-                
-                for dir in dirs:
-                    if dir:  # Ignore empty strings
-                        yield from list_files(os.path.join(dir_path, dir).replace('\\', '/'))
-
-            mp_files = list(list_files(mp_path))
-            
-            for mp_file in mp_files:
-                relative_path = os.path.relpath(mp_file, mp_path)
-                local_file = os.path.join(local_path, relative_path)
-                self.download_single_file(mp_file, local_file)
+        delete = self.sync_delete_check.isChecked()
+        compiler = self.mpy_compiler()
 
-        self.refresh_files()
+        index = self.local_indexes.get(local_path)
+        if index is None:
+            index = self.local_indexes[local_path] = LocalIndex.open(local_path)
 
-    def download_single_file(self, mp_file, local_file):
-        # Get file size
-        print(mp_file)
-        size = int(self.send_command(f"import os; print(os.stat('{mp_file}')[6])"))
-        
-        # Ensure the local directory exists
-        os.makedirs(os.path.dirname(local_file), exist_ok=True)
-        
-        with open(local_file, 'wb') as file:
-            # Read and write file in chunks
-            chunk_size = 1024
-            for i in range(0, size, chunk_size):
-                chunk = self.send_command(f"print(open('{mp_file}', 'rb').read({chunk_size}))")
-                chunk = ast.literal_eval(chunk)  # Convert string representation of bytes to actual bytes
-                file.write(chunk)
+        def plan(job):
+            engine = SyncEngine(self.worker.device_fs, local_path, mp_path, to_board, delete, compiler, index)
+            return engine, engine.plan()
 
+        def planned(result):
+            engine, actions = result
+            if not actions:
+                self.status_bar.showMessage("Already in sync")
+                return
+
+            # Dry run: show the planned actions before touching anything
+            counts = {}
+            for action, _ in actions:
+                counts[action] = counts.get(action, 0) + 1
+            summary = ", ".join(f"{action}: {count}" for action, count in counts.items())
+            box = QMessageBox(QMessageBox.Question, "Confirm Sync",
+                              f"{len(actions)} action(s) planned ({summary}). Continue?",
+                              QMessageBox.Yes | QMessageBox.No, self)
+            box.setDetailedText("\n".join(f"{action} {rel}" for action, rel in actions))
+            if box.exec_() != QMessageBox.Yes:
+                return
+
+            # The copies are listed in the transfer queue while the sync runs
+            copies = {}
+            sizes = engine.local_files if to_board else engine.remote_files
+            for action, rel in actions:
+                if action == 'upload':
+                    copies[rel] = Transfer(action, engine.local_path(rel), engine.remote_path(rel), sizes.get(rel, 0))
+                elif action == 'download':
+                    copies[rel] = Transfer(action, engine.remote_path(rel), engine.local_path(rel), sizes.get(rel, 0))
+            batch = TransferBatch(list(copies.values()))
+            self.sync_batches.append(batch)
+            self.transfer_dock.refresh()
+
+            def apply(job):
+                done_count = [0]
+                batch.started = time.monotonic()
+
+                def progress(action, rel):
+                    done_count[0] += 1
+                    transfer = copies.get(rel)
+                    if transfer:
+                        transfer.state, transfer.done = 'done', transfer.size
+                    job.report(done_count[0], len(actions), f"{action} {rel}")
+
+                engine.apply(actions, progress)
+
+            def finished(result=None):
+                batch.cancel()
+                self.sync_batches.remove(batch)
+                self.transfer_dock.finish(batch)
+                # Also on failure: some actions may already have been applied
+                dirs = engine.affected_remote_dirs(actions)
+                self.listing_cache.invalidate(*dirs)
+                self.reload_mp_dirs(dirs)
+
+            def failed(e):
+                QMessageBox.critical(self, "Error", f"Sync failed: {str(e)}")
+                finished()
+
+            self.run_job('sync', apply, finished, failed, finished)
+
+        self.run_job('sync', plan, planned)
 
     def refresh_files(self):
-        self.get_file_list()
+        self.get_file_list(force=True)
 
-    def handle_file_drop(self, file_path):
-        self.upload_single_file(file_path)
+    def handle_file_drop(self, file_paths):
+        self.upload_files(file_paths)
 
     def navigate_local(self):
         path = self.local_nav.path_edit.text()
         if os.path.exists(path):
-            index = self.local_model.index(path)
-            self.local_tree.setRootIndex(index)
-            self.local_nav.path_edit.setText(path)
+            self.set_local_path(path)
         else:
             self.status_bar.showMessage("Invalid path", 3000)
 
     def navigate_mp(self):
         path = self.mp_nav.path_edit.text()
-        if self.send_command(f"import os; print(os.path.exists('{path}'))") == "True":
-            self.set_mp_path(path)
-        else:
-            self.status_bar.showMessage("Invalid path", 3000)
+
+        def checked(mode):
+            if mode is not None:
+                self.set_mp_path(path)
+            else:
+                self.status_bar.showMessage("Invalid path", 3000)
+
+        self.run_job('navigate', lambda job: self.worker.device_fs.stat_mode(path), checked)
 
     def browse_local_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder")
         if folder:
-            index = self.local_model.index(folder)
-            self.local_tree.setRootIndex(index)
-            self.local_nav.path_edit.setText(folder)
+            self.set_local_path(folder)
 
     def go_up_local(self):
-        current_index = self.local_tree.rootIndex()
-        parent_index = current_index.parent()
-        if parent_index.isValid():
-            self.local_tree.setRootIndex(parent_index)
-            self.local_nav.path_edit.setText(self.local_model.filePath(parent_index))
+        current_path = self.local_model.filePath(self.local_tree.rootIndex())
+        parent_path = os.path.dirname(current_path)
+        if parent_path != current_path:
+            self.set_local_path(parent_path)
 
     def go_up_mp(self):
         current_path = self.get_current_mp_path()
@@ -697,13 +1667,11 @@ class MicroPythonFileManager(QMainWindow):
 
     def on_local_double_click(self, index):
         if self.local_model.isDir(index):
-            self.local_tree.setRootIndex(index)
-            self.local_nav.path_edit.setText(self.local_model.filePath(index))
+            self.set_local_path(self.local_model.filePath(index))
 
     def on_mp_double_click(self, index):
-        file_path = self.micro_model.filePath(index)
-        if self.send_command(f"import os; print(os.path.isdir('{file_path}'))") == "True":
-            self.set_mp_path(file_path)
+        if self.micro_model.node(index).is_dir:
+            self.set_mp_path(self.micro_model.filePath(index))
 
     def get_current_mp_path(self):
         return self.mp_nav.path_edit.text() or "/"
@@ -711,6 +1679,7 @@ class MicroPythonFileManager(QMainWindow):
     def load_last_directory(self):
         settings = QSettings("YourCompany", "MicroPythonFileManager")
         last_dir = settings.value("last_directory", QDir.homePath())
+        self.local_model.setRootPath(last_dir)
         index = self.local_model.index(last_dir)
         self.local_tree.setRootIndex(index)
         self.local_nav.path_edit.setText(last_dir)
@@ -720,6 +1689,16 @@ class MicroPythonFileManager(QMainWindow):
         settings = QSettings("YourCompany", "MicroPythonFileManager")
         settings.setValue("last_directory", current_dir)
 
+    def transfer_summary(self, transfer, elapsed, resumed_from=0):
+        size, wire = transfer
+        elapsed = max(elapsed, 1e-6)
+        summary = f"{self.format_size(size)} in {elapsed:.2f} s ({size / 1024 / elapsed:.1f} KB/s)"
+        if wire < size:
+            summary += f", compressed {size / max(wire, 1):.1f}x"
+        if resumed_from:
+            summary += f", resumed after {self.format_size(resumed_from)}"
+        return summary
+
     @staticmethod
     def format_size(size):
         for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
@@ -747,10 +1726,15 @@ class MicroPythonFileManager(QMainWindow):
         return icons.get(name, '')
 
 
-if __name__ == '__main__':
+def main():
+    started = time.perf_counter()
     app = QApplication(sys.argv)
-    window = MicroPythonFileManager()
+    window = MicroPythonFileManager(started)
     window.show()
     sys.exit(app.exec_())
 
 
+if __name__ == '__main__':
+    main()
+
+
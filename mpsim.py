@@ -0,0 +1,623 @@
+# Simulated MicroPython board behind a pseudo-terminal, for benchmarks and
+# protocol testing without hardware. It speaks the friendly REPL, the raw REPL
+# and raw-paste mode; scripts run in CPython against stand-ins for the
+# MicroPython modules the file manager relies on, with the board's filesystem
+# mapped onto a local directory. Link speed, latency, the UART receive buffer
+# and flash write speed can be emulated. POSIX only.
+#
+#   python mpsim.py ROOT [--baud 115200] [--latency 0.002]
+#
+# prints the pty path to connect to (e.g. mpfiles -p /dev/pts/5 ls).
+import argparse
+import binascii
+import builtins
+import ctypes
+import errno
+import hashlib
+import io
+import os
+import queue
+import select
+import struct
+import threading
+import time
+import traceback
+import types
+import zlib
+
+BANNER = b"MicroPython v1.22.0 on 2024-01-01; Simulated board with mpsim\r\n"
+RAW_BANNER = b"raw REPL; CTRL-B to exit\r\n>"
+
+
+class SimInterrupt(BaseException):
+    # Stands in for KeyboardInterrupt inside scripts so the host process
+    # never sees a stray one
+    pass
+
+
+class SimFile:
+    # File object that takes as long to write as the emulated flash would
+    def __init__(self, file, board):
+        self._file = file
+        self._board = board
+
+    def write(self, data):
+        if self._board.flash_rate:
+            time.sleep(len(data) / self._board.flash_rate)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._file.close()
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class DeflateIO:
+    # Subset of MicroPython's deflate.DeflateIO (zlib format only)
+    def __init__(self, stream, format=1, wbits=0, close=False):
+        self.stream = stream
+        self.wbits = wbits or 15
+        self.decompressor = None
+        self.compressor = None
+        self.pending = b''
+
+    def read(self, size=-1):
+        if self.decompressor is None:
+            self.decompressor = zlib.decompressobj()
+        while (size < 0 or len(self.pending) < size) and not self.decompressor.eof:
+            buf = bytearray(64)
+            n = self.stream.readinto(buf)
+            if not n:
+                break
+            self.pending += self.decompressor.decompress(bytes(buf[:n]))
+        size = len(self.pending) if size < 0 else size
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def readinto(self, buf):
+        data = self.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data):
+        if self.compressor is None:
+            self.compressor = zlib.compressobj(9, zlib.DEFLATED, max(self.wbits, 9))
+        out = self.compressor.compress(bytes(data))
+        if out:
+            self.stream.write(out)
+        return len(data)
+
+    def close(self):
+        if self.compressor is not None:
+            self.stream.write(self.compressor.flush())
+
+
+class SimulatedBoard:
+    def __init__(self, root, baudrate=115200, latency=0.0, rx_buffer=256, paste_window=128, flow_control=False,
+                 flash_rate=0, mem_free=100000, capacity=2 * 1024 * 1024, compression='deflate'):
+        # baudrate: 0 for unlimited link speed; latency: seconds added to each
+        # direction; rx_buffer: bytes a running script's stdin can hold before
+        # input is dropped (unless flow_control, as on native USB); flash_rate:
+        # file write speed in bytes/s (0 = instant); mem_free: heap reported by
+        # gc.mem_free(), and a single stdin read or line longer than a quarter
+        # of it raises MemoryError; compression: 'deflate', 'inflate' (no
+        # compressor), 'zlib' (DecompIO only) or None
+        self.root = os.path.abspath(root)
+        self.byte_time = 10.0 / baudrate if baudrate else 0.0
+        self.latency = latency
+        self.rx_buffer = rx_buffer
+        self.paste_window = paste_window
+        # An unlimited link can't be paced, so it can't overrun either
+        self.flow_control = flow_control or not baudrate
+        self.flash_rate = flash_rate
+        self.mem_free = mem_free
+        self.capacity = capacity
+        self.compression = compression
+
+        self.stats = {'commands': 0, 'round_trips': 0, 'rx_bytes': 0, 'tx_bytes': 0, 'overruns': 0}
+        self.port = None
+        self._running = False
+        self._threads = []
+        self._master = self._slave = None
+        self._tx = queue.Queue()
+        self._rx = queue.Queue()
+        self._stdin = bytearray()
+        self._wanted = 0
+        self._stdin_ready = threading.Condition()
+        self._lock = threading.Lock()
+        self._reset_state()
+
+    def _reset_state(self):
+        self.mode = 'friendly'
+        self.line = bytearray()
+        self.raw_buf = bytearray()
+        self.paste = None
+        self.script = None
+        self.interrupt = False
+        self.kbd_intr = 3
+        self.cwd = '/'
+        self.last_input = False
+
+    # Host side: pty and link emulation
+
+    def start(self):
+        import pty
+        import tty
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._threads = [threading.Thread(target=target, daemon=True)
+                         for target in (self._read_loop, self._deliver_loop, self._write_loop)]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        # The I/O threads must be gone before the fds are closed, or they
+        # could end up on a reused descriptor
+        self._running = False
+        self._tx.put(None)
+        self._rx.put(None)
+        for thread in self._threads:
+            thread.join(1)
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _read_loop(self):
+        master = self._master
+        clock = 0.0
+        while self._running:
+            try:
+                if not select.select([master], [], [], 0.1)[0]:
+                    continue
+                data = os.read(master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+            # Bytes arrive one byte time apart, after the link latency; hand
+            # them over about a millisecond's worth at a time
+            clock = max(clock, time.monotonic() + self.latency)
+            step = max(1, int(0.001 / self.byte_time)) if self.byte_time else len(data)
+            for i in range(0, len(data), step):
+                piece = data[i:i + step]
+                clock += len(piece) * self.byte_time
+                self._rx.put((clock, piece))
+
+    def _deliver_loop(self):
+        while True:
+            item = self._rx.get()
+            if item is None:
+                return
+            due, data = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self.stats['rx_bytes'] += len(data)
+                self.last_input = True
+            for i in range(len(data)):
+                self._receive(data[i:i + 1])
+
+    def _write_loop(self):
+        master = self._master
+        clock = 0.0
+        while True:
+            item = self._tx.get()
+            if item is None:
+                return
+            # Latency counts from when the script wrote the data, so back-to-back
+            # writes share it instead of adding it once each
+            written, data = item
+            clock = max(clock, written + self.latency) + len(data) * self.byte_time
+            delay = clock - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                os.write(master, data)
+            except OSError:
+                return
+
+    def _emit(self, data):
+        if not data:
+            return
+        with self._lock:
+            self.stats['tx_bytes'] += len(data)
+            # A reply after new input completes one round trip
+            if self.last_input:
+                self.stats['round_trips'] += 1
+                self.last_input = False
+        self._tx.put((time.monotonic(), bytes(data)))
+
+    # Device side: REPL state machine
+
+    def _receive(self, b):
+        if self.script is not None:
+            if b == b'\x03' and self.kbd_intr == 3:
+                self._interrupt_script()
+                return
+            with self._stdin_ready:
+                # A script blocked in a read drains the UART as bytes arrive;
+                # otherwise only rx_buffer bytes fit until it reads again
+                if not self.flow_control and len(self._stdin) >= self.rx_buffer + self._wanted:
+                    with self._lock:
+                        self.stats['overruns'] += 1
+                    return
+                self._stdin += b
+                self._stdin_ready.notify_all()
+            return
+
+        if self.paste is not None:
+            if b == b'\x04':
+                self._emit(b'\x04')
+                source, self.paste = bytes(self.paste), None
+                self._run(source, raw=True)
+                return
+            self.paste += b
+            self.paste_received += 1
+            if self.paste_received % self.paste_window == 0:
+                self._emit(b'\x01')
+            return
+
+        if self.mode == 'raw':
+            self._receive_raw(b)
+        else:
+            self._receive_friendly(b)
+
+    def _receive_raw(self, b):
+        if b == b'\x01' and self.raw_buf == b'\x05A':
+            self.raw_buf.clear()
+            self._emit(b'R\x01' + struct.pack('<H', self.paste_window))
+            self.paste = bytearray()
+            self.paste_received = 0
+        elif b == b'\x01':
+            self.raw_buf.clear()
+            self._emit(RAW_BANNER)
+        elif b == b'\x02':
+            self.mode = 'friendly'
+            self.raw_buf.clear()
+            self._emit(b'\r\n' + BANNER + b'Type "help()" for more information.\r\n>>> ')
+        elif b == b'\x03':
+            self.raw_buf.clear()
+        elif b == b'\x04':
+            if not self.raw_buf:
+                self._soft_reset()
+                self._emit(b'OK\r\nMPY: soft reboot\r\n' + RAW_BANNER)
+                return
+            source = bytes(self.raw_buf)
+            self.raw_buf.clear()
+            self._emit(b'OK')
+            self._run(source, raw=True)
+        else:
+            self.raw_buf += b
+
+    def _receive_friendly(self, b):
+        if b == b'\x01':
+            self.mode = 'raw'
+            self.raw_buf.clear()
+            self._emit(RAW_BANNER)
+        elif b == b'\x02':
+            self._emit(b'\r\n' + BANNER + b'Type "help()" for more information.\r\n>>> ')
+        elif b == b'\x03':
+            self.line.clear()
+            self._emit(b'\r\n>>> ')
+        elif b == b'\x04':
+            self._soft_reset()
+            self._emit(b'\r\nMPY: soft reboot\r\n' + BANNER + b'Type "help()" for more information.\r\n>>> ')
+        elif b in (b'\r', b'\n'):
+            source = bytes(self.line)
+            self.line.clear()
+            self._emit(b'\r\n')
+            if source.strip():
+                self._run(source, raw=False)
+            else:
+                self._emit(b'>>> ')
+        elif b in (b'\x08', b'\x7f'):
+            if self.line:
+                self.line.pop()
+                self._emit(b'\x08 \x08')
+        else:
+            self.line += b
+            self._emit(b)
+
+    def _soft_reset(self):
+        self.cwd = '/'
+        self.kbd_intr = 3
+
+    def _interrupt_script(self):
+        self.interrupt = True
+        with self._stdin_ready:
+            self._stdin_ready.notify_all()
+        thread = self.script
+        if thread is not None and thread.ident:
+            ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(thread.ident), ctypes.py_object(SimInterrupt))
+
+    def _run(self, source, raw):
+        with self._lock:
+            self.stats['commands'] += 1
+        self.interrupt = False
+        with self._stdin_ready:
+            self._stdin.clear()
+
+        def target():
+            stdout = self._make_stdout()
+            namespace = {'__builtins__': self._make_builtins(stdout), '__name__': '__main__'}
+            error = b''
+            try:
+                text = source.decode('utf-8')
+                if raw:
+                    exec(compile(text, '<stdin>', 'exec'), namespace)
+                else:
+                    # The friendly REPL echoes the value of an expression
+                    try:
+                        code = compile(text, '<stdin>', 'eval')
+                    except SyntaxError:
+                        exec(compile(text, '<stdin>', 'exec'), namespace)
+                    else:
+                        value = eval(code, namespace)
+                        if value is not None:
+                            stdout.write(repr(value) + '\n')
+            except SimInterrupt:
+                error = b'Traceback (most recent call last):\r\n  File "<stdin>"\r\nKeyboardInterrupt: \r\n'
+            except BaseException as e:
+                # CPython raises OSError(2, ...) as FileNotFoundError; the board
+                # reports every one as OSError
+                lines = ['OSError: %s\n' % e] if isinstance(e, OSError) else traceback.format_exception_only(type(e), e)
+                error = ('Traceback (most recent call last):\n  File "<stdin>"\n' + ''.join(lines)).replace(
+                    '\n', '\r\n').encode('utf-8', errors='replace')
+            self.script = None
+            self.kbd_intr = 3
+            if raw:
+                self._emit(b'\x04' + error + b'\x04>')
+            else:
+                self._emit(error + b'>>> ')
+
+        self.script = threading.Thread(target=target, daemon=True)
+        self.script.start()
+
+    # Script environment
+
+    def _read_stdin(self, size=None, line=False):
+        out = bytearray()
+        if size is not None and size > self.mem_free // 4:
+            raise MemoryError(f"memory allocation failed, allocating {size} bytes")
+        with self._stdin_ready:
+            self._wanted = float('inf') if line else size
+            try:
+                while True:
+                    if self.interrupt:
+                        raise SimInterrupt()
+                    if line:
+                        idx = self._stdin.find(b'\n')
+                        if idx >= 0:
+                            out += self._stdin[:idx + 1]
+                            del self._stdin[:idx + 1]
+                            return bytes(out)
+                        out += self._stdin
+                        self._stdin.clear()
+                        if len(out) > self.mem_free // 4:
+                            raise MemoryError(f"memory allocation failed, allocating {len(out)} bytes")
+                    else:
+                        take = size - len(out)
+                        out += self._stdin[:take]
+                        del self._stdin[:take]
+                        if len(out) == size:
+                            return bytes(out)
+                    self._stdin_ready.wait(0.1)
+            finally:
+                self._wanted = 0
+
+    def _make_stdout(self):
+        board = self
+
+        class Buffer:
+            def write(self, data):
+                board._emit(bytes(data))
+                return len(data)
+
+        class Stdout:
+            buffer = Buffer()
+
+            def write(self, data):
+                if isinstance(data, str):
+                    data = data.encode('utf-8')
+                # Text output is "cooked" as on the board's console
+                board._emit(bytes(data).replace(b'\n', b'\r\n'))
+                return len(data)
+
+        return Stdout()
+
+    def _make_stdin(self):
+        board = self
+
+        class Buffer:
+            def read(self, size):
+                return board._read_stdin(size)
+
+            def readinto(self, buf):
+                data = board._read_stdin(len(buf))
+                buf[:len(data)] = data
+                return len(data)
+
+        class Stdin:
+            buffer = Buffer()
+
+            def read(self, size):
+                return board._read_stdin(size).decode('utf-8', errors='replace')
+
+            def readline(self):
+                return board._read_stdin(line=True).decode('utf-8', errors='replace')
+
+        return Stdin()
+
+    def _path(self, path):
+        if not path.startswith('/'):
+            path = self.cwd.rstrip('/') + '/' + path
+        path = os.path.normpath('/' + path.lstrip('/')).replace(os.sep, '/')
+        return self.root + path if path != '/' else self.root
+
+    def _call(self, fn, *args):
+        # Errors read as on the board: "[Errno 2] ENOENT"
+        try:
+            return fn(*args)
+        except OSError as e:
+            raise OSError(e.errno, errno.errorcode.get(e.errno, '')) from None
+
+    def _used_space(self):
+        used = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                used += os.path.getsize(os.path.join(dirpath, name))
+        return used
+
+    def _make_os(self):
+        board = self
+        fs = types.SimpleNamespace()
+
+        def ilistdir(path=''):
+            base = board._path(path or board.cwd)
+            for name in board._call(os.listdir, base):
+                st = os.stat(os.path.join(base, name))
+                yield name, 0x4000 if os.path.isdir(os.path.join(base, name)) else 0x8000, 0, st.st_size
+
+        def stat(path):
+            full = board._path(path)
+            st = board._call(os.stat, full)
+            mode = 0x4000 if os.path.isdir(full) else 0x8000
+            size = 0 if mode == 0x4000 else st.st_size
+            mtime = int(st.st_mtime)
+            return (mode, 0, 0, 0, 0, 0, size, mtime, mtime, mtime)
+
+        def statvfs(path):
+            bsize = 4096
+            blocks = board.capacity // bsize
+            free = max(0, board.capacity - board._used_space()) // bsize
+            return (bsize, bsize, blocks, free, free, 0, 0, 0, 0, 255)
+
+        def chdir(path):
+            full = board._path(path)
+            if not os.path.isdir(full):
+                raise OSError(2, 'ENOENT')
+            board.cwd = '/' + os.path.relpath(full, board.root).replace(os.sep, '/').lstrip('.')
+
+        fs.listdir = lambda path='': sorted(board._call(os.listdir, board._path(path or board.cwd)))
+        fs.ilistdir = ilistdir
+        fs.stat = stat
+        fs.statvfs = statvfs
+        fs.remove = lambda path: board._call(os.remove, board._path(path))
+        fs.rmdir = lambda path: board._call(os.rmdir, board._path(path))
+        fs.mkdir = lambda path: board._call(os.mkdir, board._path(path))
+        fs.rename = lambda old, new: board._call(os.replace, board._path(old), board._path(new))
+        fs.chdir = chdir
+        fs.getcwd = lambda: board.cwd
+        fs.sync = lambda: None
+        fs.uname = lambda: types.SimpleNamespace(sysname='mpsim', nodename='mpsim', release='1.22.0',
+                                                 version='v1.22.0 on 2024-01-01',
+                                                 machine='Simulated board with mpsim')
+        return fs
+
+    def _make_modules(self, stdout):
+        board = self
+        modules = {
+            'sys': types.SimpleNamespace(stdin=self._make_stdin(), stdout=stdout, platform='mpsim',
+                                         implementation=types.SimpleNamespace(name='micropython',
+                                                                              version=(1, 22, 0), _mpy=0x206),
+                                         version='3.4.0; MicroPython v1.22.0', maxsize=2 ** 31 - 1),
+            'os': self._make_os(),
+            'micropython': types.SimpleNamespace(kbd_intr=lambda c: setattr(board, 'kbd_intr', c),
+                                                 const=lambda value: value),
+            'gc': types.SimpleNamespace(mem_free=lambda: board.mem_free, mem_alloc=lambda: 20000,
+                                        collect=lambda: None),
+            'machine': types.SimpleNamespace(unique_id=lambda: hashlib.sha1(board.root.encode()).digest()[:8]),
+            'binascii': binascii,
+            'hashlib': types.SimpleNamespace(sha256=hashlib.sha256, sha1=hashlib.sha1),
+            'time': types.SimpleNamespace(time=time.time, sleep=time.sleep,
+                                          sleep_ms=lambda ms: time.sleep(ms / 1000),
+                                          ticks_ms=lambda: int(time.monotonic() * 1000) & 0x3FFFFFFF,
+                                          ticks_diff=lambda a, b: a - b),
+            'struct': struct,
+            'errno': types.SimpleNamespace(ENOENT=2, EIO=5, EEXIST=17, ENOSPC=28),
+            'io': types.SimpleNamespace(IOBase=object, BytesIO=io.BytesIO, StringIO=io.StringIO),
+        }
+        if self.compression in ('deflate', 'inflate'):
+            class InflateOnly(DeflateIO):
+                def write(self, data):
+                    raise OSError(1, 'EPERM')
+
+            deflate_io = InflateOnly if self.compression == 'inflate' else DeflateIO
+            modules['deflate'] = types.SimpleNamespace(DeflateIO=deflate_io, AUTO=0, RAW=-1, ZLIB=1, GZIP=2)
+        elif self.compression == 'zlib':
+            modules['zlib'] = types.SimpleNamespace(DecompIO=lambda stream, wbits=0: DeflateIO(stream, 1, wbits))
+        for name in ('os', 'binascii', 'hashlib', 'time', 'struct', 'errno', 'io', 'sys'):
+            modules['u' + name] = modules[name]
+        return modules
+
+    def _make_builtins(self, stdout):
+        board = self
+        modules = self._make_modules(stdout)
+        namespace = dict(vars(builtins))
+
+        def import_(name, globals=None, locals=None, fromlist=(), level=0):
+            if name not in modules:
+                raise ImportError(f"no module named '{name}'")
+            return modules[name]
+
+        def open_(path, mode='r', *args, **kwargs):
+            return SimFile(board._call(builtins.open, board._path(path), mode), board)
+
+        def print_(*args, sep=' ', end='\n', file=None):
+            (file or stdout).write(sep.join(str(arg) for arg in args) + end)
+
+        namespace.update(__import__=import_, open=open_, print=print_, KeyboardInterrupt=SimInterrupt)
+        return namespace
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='mpsim', description="Run a simulated MicroPython board on a pty")
+    parser.add_argument('root', help="local directory used as the board's filesystem")
+    parser.add_argument('--baud', type=int, default=115200, help="emulated link speed (0 = unlimited)")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added in each direction")
+    parser.add_argument('--rx-buffer', type=int, default=256)
+    parser.add_argument('--flow-control', action='store_true', help="never drop input (native USB)")
+    parser.add_argument('--flash-rate', type=int, default=0, help="file write speed in bytes/s")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.root, exist_ok=True)
+    board = SimulatedBoard(args.root, baudrate=args.baud, latency=args.latency, rx_buffer=args.rx_buffer,
+                           flow_control=args.flow_control, flash_rate=args.flash_rate).start()
+    print(board.port, flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        board.stop()
+        print(board.snapshot())
+
+
+if __name__ == '__main__':
+    main()